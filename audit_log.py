@@ -0,0 +1,129 @@
+# =============================================================================
+# NHẬT KÝ REQUEST (AUDIT): GHI THEO LÔ Ở NỀN, XOAY VÒNG FILE JSONL (+ GZIP), BỎ/LẤY MẪU KHI QUÁ TẢI
+# =============================================================================
+# Request chỉ đẩy 1 dict vào hàng đợi trong RAM (không I/O); task nền gom lô rồi ghi file trong thread.
+
+import asyncio
+import contextvars
+import glob
+import gzip
+import json
+import os
+import shutil
+import time
+from collections import deque
+
+class AuditLog:
+    def __init__(self, path, batch_size=500, flush_interval=1.0, max_queue=50000,
+                 max_bytes=50_000_000, backups=10, compress=True, sample_every=10):
+        self.path, self.batch_size, self.flush_interval = path, batch_size, flush_interval
+        self.max_queue, self.max_bytes, self.backups = max_queue, max_bytes, backups
+        self.compress, self.sample_every = compress, max(1, sample_every)
+        self._queue = deque()
+        self._wake = None
+        self._seen = 0
+        self._request = contextvars.ContextVar("vhu_audit_record", default=None)
+        self.stats = {"queued": 0, "written": 0, "sampled_out": 0, "dropped": 0, "rotations": 0}
+
+    @property
+    def wake(self):
+        if self._wake is None: self._wake = asyncio.Event()
+        return self._wake
+
+    def annotate(self, **fields):
+        # Handler thêm thông tin (SV, câu hỏi...) vào bản ghi của request hiện tại
+        record = self._request.get()
+        if record is not None: record.update(fields)
+
+    def log(self, record):
+        # Không bao giờ chặn request: đầy hàng đợi -> bỏ; quá nửa -> chỉ giữ 1/sample_every bản ghi
+        n = len(self._queue)
+        if n >= self.max_queue:
+            self.stats["dropped"] += 1
+            return
+        if n >= self.max_queue // 2:
+            self._seen += 1
+            if self._seen % self.sample_every:
+                self.stats["sampled_out"] += 1
+                return
+            record["sample_weight"] = self.sample_every
+        self._queue.append(record)
+        self.stats["queued"] += 1
+        if n + 1 >= self.batch_size: self.wake.set()
+
+    async def run(self, stop_event: asyncio.Event):
+        # Task nền: ghi khi đủ lô hoặc sau flush_interval giây; dừng -> ghi nốt phần còn lại
+        while not stop_event.is_set():
+            try: await asyncio.wait_for(self.wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError: pass
+            self.wake.clear()
+            await self.flush()
+        await self.flush()
+
+    async def flush(self):
+        loop = asyncio.get_running_loop()
+        while self._queue:
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            await loop.run_in_executor(None, self._write, batch)
+
+    def _write(self, batch):
+        data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch).encode("utf-8")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(data)
+            size = os.fstat(f.fileno()).st_size # Kích thước thật của file (gồm cả phần worker khác đã ghi)
+        self.stats["written"] += len(batch)
+        if size >= self.max_bytes: self._rotate()
+
+    def _rotate(self):
+        # audit.jsonl -> audit-YYYYmmdd-HHMMSS-ffffff-<pid>.jsonl(.gz), chỉ giữ `backups` file gần nhất.
+        # Tên theo micro giây -> luôn tăng, không dùng lại tên của file vừa bị xóa khi dọn bản cũ; pid -> các worker
+        # xoay vòng cùng lúc không trùng tên
+        try:
+            # Nhiều worker cùng ghi 1 file: worker khác vừa xoay vòng xong -> file mới còn nhỏ, bỏ qua
+            if os.stat(self.path).st_size < self.max_bytes: return
+        except FileNotFoundError: return
+        base, ext = os.path.splitext(self.path)
+        now = time.time()
+        stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1e6) % 1_000_000:06d}"
+        rotated = f"{base}-{stamp}-{os.getpid()}{ext}"
+        try: os.replace(self.path, rotated)
+        except FileNotFoundError: return
+        self.stats["rotations"] += 1
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst: shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        # Chỉ dọn bản đã xong (bỏ qua file worker khác đang nén dở)
+        old = sorted(glob.glob(f"{glob.escape(base)}-*{ext}" + (".gz" if self.compress else "")))
+        for path in old[:max(0, len(old) - self.backups)]:
+            try: os.remove(path)
+            except FileNotFoundError: pass # Worker khác đã dọn
+
+def read_records(path):
+    # Đọc lại nhật ký (.jsonl hoặc .jsonl.gz) -> dùng cho phát lại trong benchmark.py
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip(): yield json.loads(line)
+
+class AuditMiddleware:
+    # ASGI middleware thuần: 1 bản ghi / request (route, mã trả về, độ trễ + thông tin handler thêm vào)
+    def __init__(self, app, audit, skip_paths=("/metrics",)):
+        self.app, self.audit, self.skip_paths = app, audit, skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            return await self.app(scope, receive, send)
+        record = {"ts": round(time.time(), 3), "method": scope["method"], "path": scope["path"], "status": 500}
+        if scope.get("query_string"): record["query"] = scope["query_string"].decode("latin-1")
+        token = self.audit._request.set(record)
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start": record["status"] = message["status"]
+            await send(message)
+        start = time.perf_counter()
+        try: await self.app(scope, receive, send_wrapper)
+        finally:
+            self.audit._request.reset(token)
+            record["route"] = getattr(scope.get("route"), "path", None)
+            record["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            self.audit.log(record)
@@ -0,0 +1,178 @@
+# BỘ ĐO HIỆU NĂNG CÁC API CHÍNH: /token, /api/v1/me, /api/v1/advise/learning-path, /api/v1/chat
+# Báo cáo độ trễ p50/p95/p99 và số request/giây (RPS) cho từng API.
+#
+# Cách dùng:
+#   python benchmark.py                                  -> chạy trong tiến trình, DB tạm + AI stub (offline)
+#   python benchmark.py --concurrency 100 --requests 2000 --scenarios me,advise
+#   python benchmark.py --url http://127.0.0.1:8000      -> đo server đang chạy (đã có dữ liệu mẫu)
+#   python benchmark.py --replay logs/audit.jsonl         -> phát lại request thật từ nhật ký (thêm kịch bản "replay")
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description="Đo độ trễ / thông lượng các API chính")
+parser.add_argument("--url", help="Địa chỉ server thật; bỏ trống = chạy app ngay trong tiến trình")
+parser.add_argument("--scenarios", default="token,me,advise,chat")
+parser.add_argument("--requests", type=int, default=500, help="Số request mỗi kịch bản")
+parser.add_argument("--concurrency", type=int, default=50)
+parser.add_argument("--students", type=int, default=200, help="Số SV mẫu được tạo")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--llm-latency-ms", type=int, default=200, help="Độ trễ của AI stub")
+parser.add_argument("--unique-questions", action="store_true", help="Mỗi câu hỏi chat khác nhau (không trúng cache)")
+parser.add_argument("--json", help="Ghi kết quả ra file JSON")
+parser.add_argument("--replay", help="Nhật ký audit (.jsonl / .jsonl.gz) để phát lại theo đúng thứ tự")
+args = parser.parse_args()
+
+PASSWORD = "benchmark"
+QUESTIONS = [
+    "Điều kiện tốt nghiệp là gì?",
+    "Chuẩn đầu ra tiếng Anh của trường?",
+    "Mẫu đơn đăng ký học phần ở đâu?",
+    "Thủ tục rút bớt học phần như thế nào?",
+    "Chương trình đào tạo ngành Khoa học dữ liệu gồm những gì?",
+    "Làm sao để xin phúc khảo bài thi?",
+]
+
+if not args.url:
+    # Cấu hình phải đặt trước khi import main. DATABASE_URL luôn là DB tạm (ghi đè biến môi trường):
+    # seed_fixtures xóa khung chương trình và chèn SV mẫu -> không bao giờ chạy lên DB thật
+    BENCH_DIR = tempfile.mkdtemp(prefix='vhu_bench_')
+    os.environ["DATABASE_URL"] = f"sqlite:///{BENCH_DIR}/bench.db"
+    os.environ.setdefault("AUDIT_LOG_PATH", os.path.join(BENCH_DIR, "audit.jsonl"))
+    os.environ.setdefault("LLM_BACKEND", "stub")
+    os.environ.setdefault("STUB_LLM_LATENCY_MS", str(args.llm_latency_ms))
+
+import httpx
+
+def seed_fixtures(rng):
+    # Khung chương trình từ init_data.py + SV mẫu có điểm ngẫu nhiên (1 lần băm mật khẩu cho tất cả)
+    from main import SessionLocal, UserDB, GradeDB, get_password_hash
+    from init_data import seed_curriculum, SUBJECTS
+    db = SessionLocal()
+    seed_curriculum(db)
+    hashed = get_password_hash(PASSWORD)
+    users, grades = [], []
+    for i in range(args.students):
+        username = f"BENCH{i:05d}"
+        taken = rng.sample([code for code, _, _ in SUBJECTS], rng.randint(0, len(SUBJECTS)))
+        grades += [{"username": username, "subject_id": code, "term": None, "score": round(rng.uniform(3, 10), 1)} for code in taken]
+        users.append({"username": username, "hashed_password": hashed, "full_name": f"Sinh viên {i}", "major_id": "CNTT",
+                      "completed_credits": 3 * len(taken), "gpa": round(rng.uniform(5, 9.5), 2)})
+    db.bulk_insert_mappings(UserDB, users)
+    db.bulk_insert_mappings(GradeDB, grades)
+    db.commit()
+    db.close()
+
+# Route không phát lại được bằng tài khoản SV mẫu (đăng nhập/đăng ký tạo dữ liệu, trang gốc)
+REPLAY_SKIP_ROUTES = ("/", "/token", "/register", "/metrics")
+# Route chỉ dành cho cố vấn/quản trị: token SV mẫu nhận 403 -> không phát lại (nhật ký cũ chưa ghi "role")
+REPLAY_STAFF_ROUTES = (
+    "/api/v1/advise/cohort-plan", "/api/v1/risk", "/api/v1/risk/batch", "/api/v1/recommend/refresh",
+    "/api/v1/subjects/{subject_id}/failed", "/api/v1/subjects/{subject_id}/retakes", "/api/v1/students/bulk",
+    "/api/v1/admin/models", "/api/v1/admin/models/reload",
+)
+
+def load_replay(path):
+    # -> [(method, đường dẫn kèm query, body JSON)] từ nhật ký audit của server.
+    # Chỉ phát lại request của SV (benchmark chỉ có token SV), số request bị bỏ theo lý do được in ra
+    from audit_log import read_records
+    requests, skipped = [], {}
+    for r in read_records(path):
+        route = r.get("route")
+        if route in REPLAY_SKIP_ROUTES or route is None: reason = "route"
+        elif r.get("role", "student") != "student" or route in REPLAY_STAFF_ROUTES: reason = "staff"
+        elif r.get("status") in (401, 403): reason = "auth"
+        elif r["method"] != "GET" and "body" not in r: reason = "no_body"
+        else:
+            url = f"{r['path']}?{r['query']}" if r.get("query") else r["path"]
+            requests.append((r["method"], url, r.get("body")))
+            continue
+        skipped[reason] = skipped.get(reason, 0) + 1
+    if skipped: print(f"⏭️ Bỏ qua khi phát lại: {skipped}")
+    return requests
+
+def percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))]
+
+async def run_scenario(client, name, make_request, n, concurrency):
+    latencies, errors = [], 0
+    queue = iter(range(n))
+    async def worker():
+        nonlocal errors
+        for i in queue:
+            start = time.perf_counter()
+            try:
+                response = await make_request(i)
+                if response.status_code >= 400: errors += 1
+            except httpx.HTTPError: errors += 1
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "scenario": name, "requests": n, "errors": errors, "concurrency": concurrency,
+        "rps": round(n / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
+
+async def main_async():
+    rng = random.Random(args.seed)
+    stop_event, flusher = asyncio.Event(), None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+    else:
+        from main import app, AUDIT, AUDIT_ENABLED
+        seed_fixtures(rng)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120)
+        # ASGITransport không chạy lifespan -> tự bật task ghi nhật ký để đo đúng chi phí thật
+        if AUDIT_ENABLED: flusher = asyncio.create_task(AUDIT.run(stop_event))
+
+    students = [f"BENCH{i:05d}" for i in range(args.students)]
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    replay = load_replay(args.replay) if args.replay else []
+    if args.replay and not replay: raise SystemExit(f"❌ Không có request nào phát lại được trong '{args.replay}'")
+    if replay and "replay" not in scenarios: scenarios.append("replay")
+    results = []
+    async with client:
+        # Lấy token cho mọi SV trước (không tính vào kết quả, trừ kịch bản "token")
+        sem = asyncio.Semaphore(args.concurrency)
+        async def login(username):
+            async with sem:
+                r = await client.post("/token", data={"username": username, "password": PASSWORD})
+                return r.json().get("access_token")
+        tokens = [t for t in await asyncio.gather(*[login(u) for u in students]) if t]
+        if not tokens: raise SystemExit("❌ Không đăng nhập được SV mẫu nào (server đã có dữ liệu BENCHxxxxx chưa?)")
+        def auth(i): return {"Authorization": f"Bearer {tokens[i % len(tokens)]}"}
+
+        requests_by_name = {
+            "token": lambda i: client.post("/token", data={"username": students[i % len(students)], "password": PASSWORD}),
+            "me": lambda i: client.get("/api/v1/me", headers=auth(i)),
+            "advise": lambda i: client.post("/api/v1/advise/learning-path", json={"target_gpa": 3.2}, headers=auth(i)),
+            "chat": lambda i: client.post("/api/v1/chat", headers=auth(i), json={
+                "message": f"{QUESTIONS[i % len(QUESTIONS)]} (#{i})" if args.unique_questions else QUESTIONS[i % len(QUESTIONS)]}),
+            "replay": lambda i: client.request(replay[i % len(replay)][0], replay[i % len(replay)][1],
+                                               json=replay[i % len(replay)][2], headers=auth(i)),
+        }
+        for name in scenarios:
+            results.append(await run_scenario(client, name, requests_by_name[name], args.requests, args.concurrency))
+    stop_event.set()
+    if flusher:
+        await flusher
+        print(f"\n📝 Nhật ký audit: {AUDIT.path} {AUDIT.stats}")
+
+    print(f"\n{'API':<8}{'requests':>10}{'errors':>8}{'RPS':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        print(f"{r['scenario']:<8}{r['requests']:>10}{r['errors']:>8}{r['rps']:>10}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -0,0 +1,59 @@
+# SCRIPT DỰNG KHO TRI THỨC (RAG) RA 1 FILE ĐỂ CÁC WORKER MỞ BẰNG MMAP
+# Đọc PDF/DOCX trong documents/, lọc trùng, chia đoạn, dựng chỉ mục BM25 rồi ghi ra KB_PATH.
+# Server thấy file này sẽ mở thẳng (không đọc tài liệu) -> khởi động gần như tức thì,
+# 8 worker uvicorn dùng chung 1 bản trong page cache của OS.
+#
+# Cách dùng:
+#   python build_kb.py                 -> dựng 1 lần
+#   python build_kb.py --watch         -> dựng xong rồi theo dõi documents/, đổi file nào đọc lại file đó
+import argparse
+import os
+import time
+
+import knowledge_base as kb
+
+parser = argparse.ArgumentParser(description="Dựng kho tri thức dùng chung (mmap) cho server")
+parser.add_argument("--root", default="documents", help="Thư mục tài liệu")
+parser.add_argument("--out", default=os.getenv("KB_PATH", os.path.join(".kb", "knowledge_base.kb")))
+parser.add_argument("--cache-dir", default=os.getenv("DOC_CACHE_DIR", ".doc_cache"))
+parser.add_argument("--workers", type=int, default=int(os.getenv("DOC_EXTRACT_WORKERS", "0")), help="0 = số CPU")
+parser.add_argument("--no-dedup", action="store_true", help="Không lọc khối văn bản trùng lặp")
+parser.add_argument("--watch", action="store_true", help="Theo dõi thư mục và dựng lại khi tài liệu thay đổi")
+args = parser.parse_args()
+
+def extract(paths):
+    entries, errors, parsed = kb.extract_entries(paths, args.root, args.cache_dir, args.workers or None)
+    for path, error in errors.items(): print(f"   ❌ [Lỗi] {os.path.basename(path)}: {error}")
+    return entries, parsed
+
+def publish(corpus, start):
+    kb.write_corpus(corpus, args.out)
+    stats = corpus.stats
+    print(f"✅ {args.out}: {len(corpus.documents)} tài liệu, {len(corpus.chunks)} đoạn, "
+          f"nén x{stats['compression_ratio']}, {os.path.getsize(args.out) / 1e6:.1f} MB ({time.perf_counter() - start:.2f}s)")
+
+def build():
+    start = time.perf_counter()
+    paths = kb.scan_documents(args.root)
+    entries, parsed = extract(paths)
+    print(f"   ⚡ Cache: {len(paths) - parsed} file dùng lại, {parsed} file đọc mới")
+    corpus = kb.Corpus(entries, not args.no_dedup)
+    publish(corpus, start)
+    return corpus
+
+def watch(corpus):
+    from watchfiles import watch as watch_files
+    def is_document(change, path): return path.endswith(kb.DOC_EXTENSIONS)
+    for changes in watch_files(args.root, watch_filter=is_document):
+        start = time.perf_counter()
+        paths = {os.path.relpath(p) for _, p in changes}
+        entries, _ = extract(sorted(p for p in paths if os.path.isfile(p)))
+        removed = (paths - set(entries)) & set(corpus.documents)
+        corpus = corpus.replace(entries, removed)
+        print(f"🔄 {len(entries)} file đọc lại, {len(removed)} file gỡ bỏ")
+        publish(corpus, start)
+
+if __name__ == "__main__":
+    if not os.path.isdir(args.root): raise SystemExit(f"❌ Không tìm thấy thư mục '{args.root}'")
+    corpus = build()
+    if args.watch: watch(corpus)
@@ -0,0 +1,74 @@
+# =============================================================================
+# LẬP KẾ HOẠCH HỌC ĐẾN KHI TỐT NGHIỆP: SẮP XẾP TOPO THEO TIÊN QUYẾT + XẾP MÔN VÀO TỪNG KỲ
+# =============================================================================
+# Xếp môn vào ít kỳ nhất dưới trần tín chỉ là bài toán NP-khó -> dùng list scheduling:
+# mỗi kỳ ưu tiên môn nằm trên chuỗi tiên quyết dài nhất (critical path), rồi theo kỳ trong khung.
+# Kết quả kèm cận dưới lý thuyết; bằng cận dưới nghĩa là đã tối ưu.
+
+import math
+
+def required_subjects(curriculum, prereqs, passed):
+    # Môn còn phải học = môn trong khung chưa qua + các môn tiên quyết (kể cả ngoài khung) chưa qua
+    required, stack = set(), [code for codes in curriculum.values() for code in codes if code not in passed]
+    while stack:
+        code = stack.pop()
+        if code in required: continue
+        required.add(code)
+        stack += [p for p in prereqs.get(code, ()) if p not in passed]
+    return required
+
+def topological_order(required, prereqs):
+    # Kahn: -> (thứ tự topo, các môn nằm trong vòng tiên quyết)
+    pending = {code: {p for p in prereqs.get(code, ()) if p in required} for code in required}
+    dependents = {}
+    for code, deps in pending.items():
+        for p in deps: dependents.setdefault(p, []).append(code)
+    ready = sorted(code for code, deps in pending.items() if not deps)
+    order = []
+    while ready:
+        code = ready.pop()
+        order.append(code)
+        for child in dependents.get(code, ()):
+            pending[child].discard(code)
+            if not pending[child]: ready.append(child)
+    return order, sorted(set(required) - set(order))
+
+def plan_degree(curriculum, prereqs, credits, passed, credit_cap):
+    # curriculum: {kỳ: [mã môn]}; prereqs: {môn: {tiên quyết}}; credits: {môn: số TC}; passed: tập môn đã qua
+    # -> {"semesters": [[mã môn]], "blocked": [mã môn], "lower_bound": số kỳ tối thiểu, "optimal": bool}
+    nominal = {}
+    for sem, codes in curriculum.items():
+        for code in codes: nominal[code] = min(sem, nominal.get(code, sem))
+    required = required_subjects(curriculum, prereqs, passed)
+
+    # Môn không có trong danh mục, môn trong vòng tiên quyết và mọi môn phụ thuộc chúng: không xếp được
+    order, blocked = topological_order(required, prereqs)
+    blocked = set(blocked) | {code for code in required if code not in credits and code not in nominal}
+    for code in order:
+        if any(p in blocked for p in prereqs.get(code, ())): blocked.add(code)
+    order = [code for code in order if code not in blocked]
+
+    # Độ dài chuỗi tiên quyết tính từ mỗi môn (tính ngược theo thứ tự topo)
+    height, dependents = {}, {}
+    for code in order:
+        for p in prereqs.get(code, ()): dependents.setdefault(p, []).append(code)
+    for code in reversed(order):
+        height[code] = 1 + max((height[c] for c in dependents.get(code, ())), default=0)
+
+    def priority(code): return (-height[code], nominal.get(code, math.inf), -credits.get(code, 0), code)
+
+    semesters, done, remaining = [], set(passed), set(order)
+    while remaining:
+        available = sorted((c for c in remaining if prereqs.get(c, set()) <= done), key=priority)
+        picked, load = [], 0
+        for code in available:
+            if load + credits.get(code, 0) <= credit_cap:
+                picked.append(code); load += credits.get(code, 0)
+        if not picked: picked = available[:1] # Môn nặng hơn cả trần tín chỉ: học riêng 1 kỳ
+        semesters.append(picked)
+        done.update(picked); remaining.difference_update(picked)
+
+    total = sum(credits.get(code, 0) for code in order)
+    lower_bound = max(max(height.values(), default=0), math.ceil(total / credit_cap) if credit_cap else 0)
+    return {"semesters": semesters, "blocked": sorted(blocked), "lower_bound": lower_bound,
+            "optimal": len(semesters) == lower_bound}
@@ -1,58 +1,61 @@
-# SCRIPT NẠP DỮ LIỆU KHUNG CHƯƠNG TRÌNH VÀO DATABASE
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from main import Base, SubjectDB, CurriculumDB, PrerequisiteDB, StudentDB 
-
-# Kết nối Database
-SQLALCHEMY_DATABASE_URL = "sqlite:///./vhu_data.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(bind=engine)
-db = SessionLocal()
-
-# 1. Xóa dữ liệu cũ (để tránh trùng lặp khi chạy lại)
-print("Dang xoa du lieu cu...")
-db.query(SubjectDB).delete()
-db.query(CurriculumDB).delete()
-db.query(PrerequisiteDB).delete()
-db.commit()
-
-# 2. Nạp Danh sách Môn học
-print("Dang nap Mon hoc...")
-subjects = [
-    SubjectDB(subject_id="CS101", subject_name="Nhập môn Lập trình", credits=3),
-    SubjectDB(subject_id="MA101", subject_name="Toán Cao cấp 1", credits=3),
-    SubjectDB(subject_id="ENG101", subject_name="Tiếng Anh 1", credits=3),
-    SubjectDB(subject_id="CS102", subject_name="Lập trình Nâng cao", credits=4),
-    SubjectDB(subject_id="MA102", subject_name="Toán Cao cấp 2", credits=3),
-    SubjectDB(subject_id="WEB101", subject_name="Lập trình Web", credits=3),
-    SubjectDB(subject_id="DB101", subject_name="Cơ sở dữ liệu", credits=3),
+# SCRIPT NẠP DỮ LIỆU KHUNG CHƯƠNG TRÌNH VÀO DATABASE + CHUYỂN ĐIỂM CŨ (JSON) SANG BẢNG grades
+# Cách dùng:
+#   python init_data.py            -> nạp khung chương trình rồi chuyển điểm
+#   python init_data.py migrate    -> chỉ chuyển điểm từ users.taken_subjects sang grades
+import sys
+
+from main import SessionLocal, SubjectDB, CurriculumDB, PrerequisiteDB, migrate_grades_from_json
+
+# Danh sách Môn học: (mã, tên, số tín chỉ)
+SUBJECTS = [
+    ("CS101", "Nhập môn Lập trình", 3),
+    ("MA101", "Toán Cao cấp 1", 3),
+    ("ENG101", "Tiếng Anh 1", 3),
+    ("CS102", "Lập trình Nâng cao", 4),
+    ("MA102", "Toán Cao cấp 2", 3),
+    ("WEB101", "Lập trình Web", 3),
+    ("DB101", "Cơ sở dữ liệu", 3),
 ]
-db.add_all(subjects)
-
-# 3. Nạp Khung chương trình (Ngành CNTT)
-print("Dang nap Khung chuong trinh...")
-curriculum = [
-    # Kỳ 1
-    CurriculumDB(major_id="CNTT", semester=1, subject_id="CS101"),
-    CurriculumDB(major_id="CNTT", semester=1, subject_id="MA101"),
-    CurriculumDB(major_id="CNTT", semester=1, subject_id="ENG101"),
-    # Kỳ 2
-    CurriculumDB(major_id="CNTT", semester=2, subject_id="CS102"),
-    CurriculumDB(major_id="CNTT", semester=2, subject_id="MA102"),
-    # Kỳ 3
-    CurriculumDB(major_id="CNTT", semester=3, subject_id="WEB101"),
-    CurriculumDB(major_id="CNTT", semester=3, subject_id="DB101"),
+
+# Khung chương trình ngành CNTT: (kỳ, mã môn)
+CURRICULUM = [
+    (1, "CS101"), (1, "MA101"), (1, "ENG101"), # Kỳ 1
+    (2, "CS102"), (2, "MA102"),                # Kỳ 2
+    (3, "WEB101"), (3, "DB101"),               # Kỳ 3
 ]
-db.add_all(curriculum)
 
-# 4. Nạp Điều kiện Tiên quyết
-print("Dang nap Tien quyet...")
-prereqs = [
-    PrerequisiteDB(subject_id="CS102", prerequisite_id="CS101"), # Muốn học CS102 phải qua CS101
-    PrerequisiteDB(subject_id="WEB101", prerequisite_id="CS101"),
+# Điều kiện Tiên quyết: (môn, môn tiên quyết)
+PREREQUISITES = [
+    ("CS102", "CS101"), # Muốn học CS102 phải qua CS101
+    ("WEB101", "CS101"),
 ]
-db.add_all(prereqs)
 
-db.commit()
-print("✅ HOÀN TẤT! Database đã có dữ liệu chương trình đào tạo.")
-db.close()
\ No newline at end of file
+def seed_curriculum(db, major_id="CNTT"):
+    # 1. Xóa dữ liệu cũ (để tránh trùng lặp khi chạy lại)
+    print("Dang xoa du lieu cu...")
+    db.query(SubjectDB).delete()
+    db.query(CurriculumDB).delete()
+    db.query(PrerequisiteDB).delete()
+    db.commit()
+
+    # 2. Nạp Danh sách Môn học
+    print("Dang nap Mon hoc...")
+    db.add_all([SubjectDB(subject_id=code, subject_name=name, credits=credits) for code, name, credits in SUBJECTS])
+
+    # 3. Nạp Khung chương trình
+    print("Dang nap Khung chuong trinh...")
+    db.add_all([CurriculumDB(major_id=major_id, semester=sem, subject_id=code) for sem, code in CURRICULUM])
+
+    # 4. Nạp Điều kiện Tiên quyết
+    print("Dang nap Tien quyet...")
+    db.add_all([PrerequisiteDB(subject_id=code, prerequisite_id=prereq) for code, prereq in PREREQUISITES])
+
+    db.commit()
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        db = SessionLocal()
+        seed_curriculum(db)
+        print("✅ HOÀN TẤT! Database đã có dữ liệu chương trình đào tạo.")
+        db.close()
+    migrate_grades_from_json()
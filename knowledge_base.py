@@ -0,0 +1,616 @@
+# =============================================================================
+# KHO TRI THỨC (RAG): TRÍCH XUẤT PDF/DOCX, CHIA NHỎ TÀI LIỆU + CHỈ MỤC BM25 TIẾNG VIỆT
+# =============================================================================
+
+import copy
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import unicodedata
+import zlib
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from pypdf import PdfReader
+from docx import Document
+
+DOC_EXTENSIONS = ('.pdf', '.docx')
+CHUNK_MAX_CHARS = 1200  # Độ dài tối đa 1 đoạn (chunk)
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Lọc trùng lặp: khối ~ đoạn văn; MINHASH_PERMS hàm băm chia LSH_BANDS băng;
+# 2 khối được coi là gần trùng khi >= NEAR_DUP_THRESHOLD chữ ký giống nhau
+BLOCK_MAX_CHARS = 600
+DEDUP_MIN_CHARS = 40
+SHINGLE_CHARS = 9
+MINHASH_PERMS = 64
+LSH_BANDS = 16
+NEAR_DUP_THRESHOLD = 0.8
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_BLOCK_END_RE = re.compile(r"[.:;!?…]$")
+_HASH_PRIME = 4294967291 # Số nguyên tố lớn nhất < 2^32
+_HASH_A = np.random.RandomState(1).randint(1, 2**31, MINHASH_PERMS).astype(np.uint64)
+_HASH_B = np.random.RandomState(2).randint(0, 2**31, MINHASH_PERMS).astype(np.uint64)
+
+# =============================================================================
+# 1. TRÍCH XUẤT VĂN BẢN (CÓ CACHE TRÊN ĐĨA + CHẠY SONG SONG)
+# =============================================================================
+
+def extract_pages(file_path):
+    # -> [(số trang, nội dung)]. DOCX coi cả file là trang 1
+    pages = []
+    if file_path.endswith('.pdf'):
+        reader = PdfReader(file_path)
+        for i, page in enumerate(reader.pages, 1):
+            t = page.extract_text()
+            if t: pages.append((i, t))
+    elif file_path.endswith('.docx'):
+        doc = Document(file_path)
+        t = "\n".join(para.text for para in doc.paragraphs)
+        if t.strip(): pages.append((1, t))
+    return pages
+
+def _cache_file(cache_dir, file_path):
+    return os.path.join(cache_dir, hashlib.sha1(file_path.encode("utf-8")).hexdigest() + ".json")
+
+def _read_cache(cache_dir, file_path, st):
+    try:
+        with open(_cache_file(cache_dir, file_path), encoding="utf-8") as f: entry = json.load(f)
+    except (OSError, ValueError): return None
+    # Chỉ dùng lại khi file không đổi (cùng kích thước + thời điểm sửa)
+    if entry.get("size") != st.st_size or entry.get("mtime") != st.st_mtime_ns: return None
+    return [tuple(p) for p in entry["pages"]]
+
+def _write_cache(cache_dir, file_path, st, pages):
+    path = _cache_file(cache_dir, file_path)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"path": file_path, "size": st.st_size, "mtime": st.st_mtime_ns, "pages": pages}, f, ensure_ascii=False)
+    os.replace(tmp, path) # Ghi nguyên tử, worker khác không đọc phải file dở
+
+def _extract_safe(file_path):
+    try: return extract_pages(file_path), None
+    except Exception as e: return None, str(e)
+
+def scan_documents(root):
+    # Quét đệ quy (Recursive scan) mọi thư mục con
+    found = []
+    for current_root, dirs, files in os.walk(root):
+        for filename in files:
+            if filename.endswith(DOC_EXTENSIONS): found.append(os.path.join(current_root, filename))
+    return found
+
+def document_category(file_path, root):
+    # Danh mục = tên thư mục chứa file; file nằm ngay thư mục gốc -> "CHUNG"
+    category = os.path.basename(os.path.dirname(file_path))
+    return "CHUNG" if category == os.path.basename(os.path.normpath(root)) else category
+
+def extract_all(file_paths, cache_dir=".doc_cache", workers=None):
+    # -> {file_path: (pages, lỗi)}. File chưa có cache được đọc song song bằng process pool
+    os.makedirs(cache_dir, exist_ok=True)
+    results, misses = {}, []
+    for file_path in file_paths:
+        st = os.stat(file_path)
+        pages = _read_cache(cache_dir, file_path, st)
+        if pages is None: misses.append((file_path, st))
+        else: results[file_path] = (pages, None)
+
+    # workers=1 -> đọc ngay trong thread gọi (không tạo tiến trình con)
+    if len(misses) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            extracted = list(pool.map(_extract_safe, [fp for fp, _ in misses]))
+    else:
+        extracted = [_extract_safe(fp) for fp, _ in misses]
+
+    for (file_path, st), (pages, error) in zip(misses, extracted):
+        if error is None: _write_cache(cache_dir, file_path, st, pages)
+        results[file_path] = (pages, error)
+    return results, len(misses)
+
+# =============================================================================
+# 2. CHUẨN HÓA & TÁCH TỪ (CÓ DẤU / KHÔNG DẤU)
+# =============================================================================
+
+def strip_diacritics(text):
+    # "Tốt nghiệp" -> "tot nghiep" (đ -> d)
+    text = unicodedata.normalize("NFD", text)
+    text = "".join(c for c in text if unicodedata.category(c) != "Mn")
+    return text.replace("đ", "d").replace("Đ", "D")
+
+def tokenize(text):
+    # Giữ cả từ có dấu lẫn không dấu để câu hỏi gõ thiếu dấu vẫn khớp,
+    # thêm cặp âm tiết (bigram) vì từ tiếng Việt thường gồm 2 âm tiết.
+    text = unicodedata.normalize("NFC", text.lower())
+    words = _WORD_RE.findall(text)
+    folded = [strip_diacritics(w) for w in words]
+    tokens = []
+    for w, f in zip(words, folded):
+        tokens.append(f)
+        if w != f: tokens.append(w)
+    tokens += [f"{a}_{b}" for a, b in zip(folded, folded[1:])]
+    return tokens
+
+# =============================================================================
+# 3. CHIA TÀI LIỆU THÀNH CÁC ĐOẠN (CHUNK)
+# =============================================================================
+
+def split_text(text, max_chars=CHUNK_MAX_CHARS):
+    # Gom các dòng thành đoạn <= max_chars, không cắt ngang dòng (trừ dòng quá dài)
+    parts, buf = [], ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line: continue
+        while len(line) > max_chars:
+            if buf: parts.append(buf); buf = ""
+            parts.append(line[:max_chars]); line = line[max_chars:]
+        if buf and len(buf) + len(line) + 1 > max_chars:
+            parts.append(buf); buf = ""
+        buf = f"{buf}\n{line}" if buf else line
+    if buf: parts.append(buf)
+    return parts
+
+def chunk_document(pages, category, filename, max_chars=CHUNK_MAX_CHARS):
+    # pages: [(số trang, nội dung)] -> [{"category", "filename", "page", "text"}]
+    chunks = []
+    for page, text in pages:
+        for part in split_text(text, max_chars):
+            chunks.append({"category": category, "filename": filename, "page": page, "text": part})
+    return chunks
+
+# =============================================================================
+# 4. CHỈ MỤC NGƯỢC BM25 (IN-MEMORY)
+# =============================================================================
+
+def chunk_terms(chunk):
+    # Tần suất token của 1 đoạn (tính 1 lần, dùng lại khi dựng lại chỉ mục).
+    # Đoạn dùng chung không gắn tên file nào (không thiên về tài liệu đầu tiên chứa nó)
+    if chunk.get("owners"): return Counter(tokenize(chunk["text"]))
+    return Counter(tokenize(f"{chunk['filename']} {chunk['text']}"))
+
+class BM25Index:
+    # Chỉ mục theo phiên bản, thêm/bớt được từng đoạn: posting lưu theo mã đoạn, idf và độ dài trung bình
+    # tính từ số liệu tổng khi tìm -> đổi 1 file chỉ chép lại posting của các token có trong file đó
+    def __init__(self, chunks=(), term_counts=None):
+        self.chunks = {}    # mã đoạn -> đoạn
+        self.terms = {}     # mã đoạn -> Counter token (dùng lại khi dựng lại đoạn không đổi)
+        self.lengths = {}   # mã đoạn -> số token
+        self.postings = {}  # token -> {mã đoạn: tf}
+        self.total_len = 0
+        self._next_id = 0
+        if chunks:
+            terms = term_counts if term_counts is not None else [chunk_terms(c) for c in chunks]
+            self._apply(list(zip(chunks, terms)), ())
+
+    @property
+    def avg_len(self):
+        return self.total_len / len(self.chunks) if self.chunks else 0.0
+
+    def idf(self, token):
+        n, df = len(self.chunks), len(self.postings.get(token, ()))
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def updated(self, added, removed=()):
+        # added: [(đoạn, Counter token)]; removed: [mã đoạn] -> (chỉ mục mới, [mã đoạn mới]).
+        # Bản cũ không bị sửa: request đang chạy vẫn tìm trên bản cũ
+        new = copy.copy(self)
+        new.chunks, new.terms, new.lengths, new.postings = dict(self.chunks), dict(self.terms), dict(self.lengths), dict(self.postings)
+        return new, new._apply(added, removed)
+
+    def _apply(self, added, removed):
+        copied = set() # Token đã chép posting trong lần cập nhật này (copy-on-write)
+        def posting(token):
+            p = self.postings.get(token)
+            if token not in copied:
+                copied.add(token)
+                p = self.postings[token] = dict(p or {})
+            elif p is None: p = self.postings[token] = {}
+            return p
+        for i in removed:
+            del self.chunks[i]
+            self.total_len -= self.lengths.pop(i)
+            for token in self.terms.pop(i): del posting(token)[i]
+        ids = []
+        for chunk, tf in added:
+            i, self._next_id = self._next_id, self._next_id + 1
+            self.chunks[i], self.terms[i], self.lengths[i] = chunk, tf, sum(tf.values())
+            self.total_len += self.lengths[i]
+            for token, count in tf.items(): posting(token)[i] = count
+            ids.append(i)
+        for token in copied:
+            if not self.postings[token]: del self.postings[token]
+        return ids
+
+    def search(self, query, top_k=5):
+        avg_len = self.avg_len
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if not posting: continue
+            idf = self.idf(token)
+            for i, tf in posting.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / avg_len)
+                scores[i] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:top_k]
+        return [(self.chunks[i], score) for i, score in best]
+
+def chunk_source(chunk):
+    # Nhãn nguồn của đoạn; đoạn dùng chung liệt kê mọi tài liệu chứa nó (gom theo danh mục)
+    if not chunk.get("owners"): return f"{chunk['category'].upper()} | {chunk['filename']} | trang {chunk['page']}"
+    groups = {}
+    for category, filename in chunk["owners"]: groups.setdefault(category, []).append(filename)
+    return "DÙNG CHUNG | " + "; ".join(f"{c.upper()}: {', '.join(files)}" for c, files in groups.items())
+
+def build_context(index, query, top_k=5, max_chars=6000):
+    # Ghép các đoạn liên quan nhất, dừng khi vượt ngân sách ký tự của prompt
+    if index is None: return ""
+    blocks, used = [], 0
+    for chunk, _ in index.search(query, top_k):
+        block = f"[{chunk_source(chunk)}]\n{chunk['text']}\n"
+        if used + len(block) > max_chars: continue
+        blocks.append(block); used += len(block)
+    return "\n".join(blocks)
+
+
+# =============================================================================
+# 5. LỌC KHỐI VĂN BẢN TRÙNG LẶP GIỮA CÁC TÀI LIỆU (SHINGLING + MINHASH/LSH)
+# =============================================================================
+
+def split_blocks(text, max_chars=BLOCK_MAX_CHARS):
+    # Gom các dòng liền nhau thành đoạn văn (hết đoạn ở dấu câu cuối dòng) -> đơn vị so trùng
+    blocks, lines, size = [], [], 0
+    for line in text.splitlines():
+        line = line.strip()
+        if not line: continue
+        lines.append(line); size += len(line) + 1
+        if _BLOCK_END_RE.search(line) or size >= max_chars:
+            blocks.append("\n".join(lines)); lines, size = [], 0
+    if lines: blocks.append("\n".join(lines))
+    return blocks
+
+def normalize_line(text):
+    # Bỏ dấu, dấu câu và MỌI khoảng trắng: PDF hay tách sai chữ ("T ỐT NGHI ỆP") khác nhau giữa các file
+    return "".join(strip_diacritics(w) for w in _WORD_RE.findall(text.lower()))
+
+def minhash(text):
+    # Chữ ký MinHash trên tập shingle SHINGLE_CHARS ký tự liên tiếp (crc32: ổn định giữa các tiến trình)
+    norm = normalize_line(text)
+    n = max(1, len(norm) - SHINGLE_CHARS + 1)
+    shingles = {norm[i:i + SHINGLE_CHARS] for i in range(n)}
+    h = np.fromiter((zlib.crc32(x.encode("utf-8")) for x in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(_HASH_A, h) + _HASH_B[:, None]) % _HASH_PRIME).min(axis=1).astype(np.uint32)
+
+def band_keys(sig):
+    # Khóa LSH: chữ ký chia LSH_BANDS băng, 2 khối chung 1 băng -> ứng viên gần trùng
+    rows = MINHASH_PERMS // LSH_BANDS
+    return [(b, sig[b * rows:(b + 1) * rows].tobytes()) for b in range(LSH_BANDS)]
+
+def residual_lines(text, canonical_norm):
+    # Dòng của bản gần trùng không có trong khối chuẩn (tên ngành, số tín chỉ...)
+    return "\n".join(l for l in text.splitlines() if normalize_line(l) not in canonical_norm)
+
+# =============================================================================
+# 6. KHO TRI THỨC THEO TỪNG FILE (CẬP NHẬT TỪNG FILE, CÔNG BỐ NGUYÊN TỬ)
+# =============================================================================
+
+def document_entry(category, filename, pages):
+    # Phần của 1 file trong kho: các khối văn bản theo trang kèm chữ ký MinHash (tính 1 lần/file)
+    blocks = [(page, b, minhash(b)) for page, text in pages for b in split_blocks(text)]
+    return {"category": category, "filename": filename, "blocks": blocks}
+
+def extract_entries(file_paths, root, cache_dir=".doc_cache", workers=None):
+    # -> ({đường dẫn: document_entry}, {đường dẫn: lỗi}, số file phải đọc mới)
+    extracted, parsed = extract_all(file_paths, cache_dir, workers)
+    entries, errors = {}, {}
+    for file_path in file_paths:
+        pages, error = extracted[file_path]
+        if error: errors[file_path] = error
+        elif pages: entries[file_path] = document_entry(document_category(file_path, root), os.path.basename(file_path), pages)
+    return entries, errors, parsed
+
+def document_banner(entry, text):
+    return (f"\n========================================\n"
+            f"📂 DANH MỤC: {entry['category'].upper()} | 📄 TÀI LIỆU: {entry['filename']}\n"
+            f"========================================\n{text}\n")
+
+class Corpus:
+    # Ảnh chụp bất biến: replace() tạo Corpus mới, chỉ sửa phần của file đổi (khối, đoạn, posting),
+    # phần còn lại dùng chung với bản cũ. Request đang chạy vẫn đọc bản cũ; gán lại 1 biến là công bố xong.
+    # Lọc trùng: mỗi khối gần trùng lưu 1 lần trong kho khối, kèm danh sách tài liệu chứa nó. Khối có ở
+    # nhiều tài liệu thành 1 đoạn riêng gắn nhãn mọi tài liệu đó (văn bản chuẩn = bản của tài liệu đứng
+    # trước theo thứ tự quét); từng tài liệu chỉ giữ các dòng khác biệt của mình.
+    def __init__(self, documents, dedup=True):
+        self.documents = {}  # đường dẫn -> document_entry (theo thứ tự quét)
+        self.dedup = dedup
+        self._order = {}     # đường dẫn -> thứ tự (tài liệu đứng trước giữ nguyên văn khối dùng chung)
+        self._refs = {}      # đường dẫn -> [(trang, mã khối, văn bản, chữ ký)]
+        self._pages = {}     # đường dẫn -> [(trang, nội dung còn lại sau lọc trùng)]
+        self._chunk_ids = {} # đường dẫn -> [mã đoạn trong chỉ mục]
+        self._sizes = {}     # đường dẫn -> (số ký tự gốc, số ký tự còn lại)
+        self._blocks = {}    # mã khối -> (văn bản chuẩn, chữ ký)
+        self._owners = {}    # mã khối -> {đường dẫn: số lần tham chiếu}
+        self._shared = {}    # mã khối dùng chung -> mã đoạn riêng của khối trong chỉ mục
+        # Dùng chung giữa các phiên bản: buckets chỉ thêm (ứng viên được kiểm lại), norms tra theo nội dung
+        self._buckets, self._norms = {}, {}
+        self._next_block = self._next_order = 0
+        self.index = BM25Index()
+        self._apply(documents, ())
+
+    def replace(self, updated=None, removed=()):
+        # updated: {đường dẫn: entry mới}; removed: các đường dẫn đã xóa
+        new = copy.copy(self)
+        for name in ("documents", "_order", "_refs", "_pages", "_chunk_ids", "_sizes", "_blocks", "_owners", "_shared"):
+            setattr(new, name, dict(getattr(self, name)))
+        new._apply(updated or {}, removed)
+        return new
+
+    def _creator(self, owners):
+        return min(owners, key=self._order.__getitem__)
+
+    def _norm(self, block_id):
+        text = self._blocks[block_id][0]
+        norm = self._norms.get(text)
+        if norm is None: norm = self._norms[text] = normalize_line(text)
+        return norm
+
+    def _match(self, text, sig):
+        if not self.dedup or len(text) < DEDUP_MIN_CHARS: return None
+        for key in band_keys(sig):
+            for c in self._buckets.get(key, ()):
+                if c in self._blocks and np.mean(self._blocks[c][1] == sig) >= NEAR_DUP_THRESHOLD: return c
+        return None
+
+    def _set_block(self, block_id, text, sig):
+        self._blocks[block_id] = (text, sig)
+        if self.dedup and len(text) >= DEDUP_MIN_CHARS:
+            for key in band_keys(sig): self._buckets.setdefault(key, []).append(block_id)
+
+    def _apply(self, updated, removed):
+        removed = [p for p in removed if p in self.documents and p not in updated]
+        before = {} # mã khối -> (các tài liệu chứa, văn bản chuẩn) trước lần cập nhật này
+        def owners_of(block_id):
+            if block_id not in before:
+                owners = self._owners.get(block_id, {})
+                before[block_id] = (list(owners), self._blocks.get(block_id, (None,))[0])
+                self._owners[block_id] = dict(owners)
+            return self._owners[block_id]
+
+        # 1. Gỡ tham chiếu khối của file bị xóa / đọc lại
+        for path in [*removed, *updated]:
+            for _, block_id, _, _ in self._refs.pop(path, ()):
+                owners = owners_of(block_id)
+                owners[path] -= 1
+                if not owners[path]: del owners[path]
+        for path in removed:
+            del self.documents[path], self._order[path], self._pages[path], self._sizes[path]
+
+        # 2. Khớp từng khối của file mới/đã sửa vào kho (LSH), không khớp -> khối mới
+        for path, entry in updated.items():
+            if path not in self._order: self._order[path], self._next_order = self._next_order, self._next_order + 1
+            self.documents[path] = entry
+            refs = []
+            for page, text, sig in entry["blocks"]:
+                block_id = self._match(text, sig)
+                if block_id is None:
+                    block_id, self._next_block = self._next_block, self._next_block + 1
+                    owners_of(block_id)
+                    self._set_block(block_id, text, sig)
+                owners = owners_of(block_id)
+                owners[path] = owners.get(path, 0) + 1
+                refs.append((page, block_id, text, sig))
+            self._refs[path] = refs
+
+        # 3. Khối bị đụng tới: bỏ khối không còn ai dùng; đổi văn bản chuẩn hoặc chuyển giữa riêng/dùng chung
+        #    -> chỉ các tài liệu chứa khối đó phải tính lại phần còn lại; đoạn dùng chung của khối dựng lại
+        affected, drop, added, shared = set(updated), [], [], []
+        for block_id, (old_owners, old_text) in before.items():
+            owners = self._owners[block_id]
+            old_chunk = self._shared.pop(block_id, None)
+            if not owners:
+                del self._owners[block_id], self._blocks[block_id]
+                if old_chunk is not None: drop.append(old_chunk)
+                continue
+            creator = self._creator(owners)
+            page, text, sig = next((p, t, g) for p, b, t, g in self._refs[creator] if b == block_id)
+            if text != old_text:
+                self._set_block(block_id, text, sig)
+                affected.update(owners)
+            if (len(owners) > 1) != (len(old_owners) > 1):
+                affected.update(p for p in (*owners, *old_owners) if p in self.documents)
+            if len(owners) > 1:
+                entry = self.documents[creator]
+                chunk = {"category": entry["category"], "filename": entry["filename"], "page": page, "text": text,
+                         "owners": [(self.documents[p]["category"], self.documents[p]["filename"])
+                                    for p in sorted(owners, key=self._order.__getitem__)]}
+                if old_chunk is not None and self.index.chunks[old_chunk] == chunk:
+                    self._shared[block_id] = old_chunk
+                    continue
+                shared.append(block_id)
+                added.append((chunk, self.index.terms[old_chunk] if text == old_text and old_chunk is not None else chunk_terms(chunk)))
+            if old_chunk is not None: drop.append(old_chunk)
+
+        # 4. Chia đoạn lại cho các tài liệu bị ảnh hưởng; đoạn không đổi dùng lại token đã tách
+        spans = []
+        for path in removed: drop += self._chunk_ids.pop(path, ())
+        for path in affected:
+            old = self._chunk_ids.pop(path, ())
+            drop += old
+            known = {(self.index.chunks[i]["page"], self.index.chunks[i]["text"]): self.index.terms[i] for i in old}
+            entry = self.documents[path]
+            self._pages[path] = self._emit(path)
+            self._sizes[path] = (sum(len(r[2]) for r in self._refs[path]), sum(len(t) for _, t in self._pages[path]))
+            chunks = chunk_document(self._pages[path], entry["category"], entry["filename"])
+            spans.append((path, len(added), len(chunks)))
+            added += [(c, known.get((c["page"], c["text"])) or chunk_terms(c)) for c in chunks]
+        self.index, ids = self.index.updated(added, drop)
+        for block_id, i in zip(shared, ids): self._shared[block_id] = i
+        for path, start, n in spans: self._chunk_ids[path] = ids[start:start + n]
+        self._chunks = self._text = None
+        self.stats = self._stats()
+
+    def _emit(self, path):
+        # Nội dung còn lại của 1 tài liệu: khối chỉ mình có giữ nguyên văn (lặp lại trong file -> bỏ phần trùng),
+        # khối dùng chung với tài liệu khác chỉ giữ dòng khác biệt (phần chung nằm ở đoạn dùng chung)
+        kept, seen = {}, set()
+        for page, block_id, text, _ in self._refs[path]:
+            first = block_id not in seen
+            seen.add(block_id)
+            if first and len(self._owners[block_id]) == 1: emitted = text
+            else: emitted = residual_lines(text, self._norm(block_id))
+            if emitted: kept.setdefault(page, []).append(emitted)
+        return [(page, "\n".join(texts)) for page, texts in kept.items()]
+
+    def _stats(self):
+        original = sum(o for o, _ in self._sizes.values())
+        stored = sum(n for _, n in self._sizes.values()) + sum(len(self.index.chunks[i]["text"]) for i in self._shared.values())
+        return {
+            "blocks": len(self._blocks), "shared_blocks": sum(1 for o in self._owners.values() if len(o) > 1),
+            "original_chars": original, "stored_chars": stored,
+            "compression_ratio": round(original / stored, 3) if stored else 1.0,
+        }
+
+    @property
+    def chunk_ids(self):
+        # Đoạn của từng tài liệu theo thứ tự quét, sau đó các đoạn dùng chung
+        return [i for path in self.documents for i in self._chunk_ids.get(path, ())] + list(self._shared.values())
+
+    @property
+    def chunks(self):
+        # Các đoạn theo thứ tự tài liệu (dựng lười, chỉ khi cần: ghi file kho, thống kê)
+        if self._chunks is None: self._chunks = [self.index.chunks[i] for i in self.chunk_ids]
+        return self._chunks
+
+    @property
+    def text(self):
+        # Toàn văn ghép các file (như PDF_CONTENT cũ, đã bỏ phần trùng), chỉ ghép khi cần
+        if self._text is None:
+            shared = [self.index.chunks[i] for i in self._shared.values()]
+            self._text = "".join(document_banner(d, "\n".join(t for _, t in self._pages[p])) for p, d in self.documents.items()) + \
+                "".join(f"\n[{chunk_source(c)}]\n{c['text']}\n" for c in shared)
+        return self._text
+
+# =============================================================================
+# 7. KHO TRI THỨC DỰNG SẴN TRÊN ĐĨA, MỞ BẰNG MMAP (DÙNG CHUNG GIỮA CÁC WORKER)
+# =============================================================================
+# Bố cục file: KB_MAGIC | độ dài meta (uint64) | meta JSON | các mảng numpy (căn lề 8 byte).
+# Worker chỉ đọc qua mmap -> OS giữ 1 bản trong page cache cho mọi tiến trình.
+
+KB_MAGIC = b"VHUKB001"
+
+def _pack_strings(strings):
+    blobs = [x.encode("utf-8") for x in strings]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(b) for b in blobs]) if blobs else []
+    return np.frombuffer(b"".join(blobs), dtype=np.uint8), offsets
+
+def write_corpus(corpus, path):
+    # Ghi Corpus (đoạn + chỉ mục BM25) ra 1 file; ghi file tạm rồi thay nguyên tử
+    index, files = corpus.index, {}
+    position = {i: k for k, i in enumerate(corpus.chunk_ids)} # mã đoạn -> vị trí trong file
+    vocab = sorted(index.postings)
+    postings = [(position[i], tf) for token in vocab for i, tf in index.postings[token].items()]
+    text, text_offsets = _pack_strings([c["text"] for c in corpus.chunks])
+    tokens, token_offsets = _pack_strings(vocab)
+    owners = [[files.setdefault(tuple(o), len(files)) for o in c.get("owners", ())] for c in corpus.chunks]
+    arrays = {
+        "chunk_file": np.array([files.setdefault((c["category"], c["filename"]), len(files)) for c in corpus.chunks], dtype=np.uint32),
+        # Tài liệu chứa từng đoạn dùng chung (rỗng với đoạn thường): owners[owner_offsets[i]:owner_offsets[i + 1]]
+        "owners": np.array([f for o in owners for f in o], dtype=np.uint32),
+        "owner_offsets": np.concatenate(([0], np.cumsum([len(o) for o in owners]))).astype(np.uint64),
+        "chunk_page": np.array([c["page"] for c in corpus.chunks], dtype=np.uint32),
+        "text": text, "text_offsets": text_offsets,
+        "tokens": tokens, "token_offsets": token_offsets,
+        "idf": np.array([index.idf(t) for t in vocab], dtype=np.float64),
+        "post_offsets": np.concatenate(([0], np.cumsum([len(index.postings[t]) for t in vocab]))).astype(np.uint64),
+        "post_chunk": np.array([i for i, _ in postings], dtype=np.uint32),
+        "post_tf": np.array([tf for _, tf in postings], dtype=np.float32),
+        "doc_len": np.array([index.lengths[i] for i in corpus.chunk_ids], dtype=np.float64),
+    }
+    sections, offset = {}, 0
+    for name, arr in arrays.items():
+        sections[name] = [offset, arr.dtype.str, int(arr.size)]
+        offset += -(-arr.nbytes // 8) * 8
+    meta = json.dumps({"files": list(files), "avg_len": index.avg_len, "stats": corpus.stats,
+                       "sections": sections}, ensure_ascii=False).encode("utf-8")
+    meta += b" " * (-(len(KB_MAGIC) + 8 + len(meta)) % 8)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(KB_MAGIC + len(meta).to_bytes(8, "little") + meta)
+        for arr in arrays.values():
+            f.write(arr.tobytes())
+            f.write(b"\0" * (-arr.nbytes % 8))
+    os.replace(tmp, path)
+
+class _MappedStrings:
+    # Dãy chuỗi đọc thẳng từ mmap (đủ __len__/__getitem__ để bisect tìm nhị phân)
+    def __init__(self, blob, offsets):
+        self.blob, self.offsets = blob, offsets
+
+    def __len__(self): return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])].tobytes().decode("utf-8")
+
+class _MappedChunks:
+    def __init__(self, texts, files, chunk_file, chunk_page, owners=None, owner_offsets=None):
+        self.texts, self.files, self.chunk_file, self.chunk_page = texts, files, chunk_file, chunk_page
+        self.owners, self.owner_offsets = owners, owner_offsets # File kho cũ không có 2 mảng này
+
+    def __len__(self): return len(self.texts)
+
+    def __getitem__(self, i):
+        category, filename = self.files[self.chunk_file[i]]
+        chunk = {"category": category, "filename": filename, "page": int(self.chunk_page[i]), "text": self.texts[i]}
+        if self.owner_offsets is not None:
+            lo, hi = int(self.owner_offsets[i]), int(self.owner_offsets[i + 1])
+            if hi > lo: chunk["owners"] = [self.files[f] for f in self.owners[lo:hi]]
+        return chunk
+
+class MappedIndex:
+    # Cùng cách chấm BM25 như BM25Index nhưng trên mảng mmap, cộng điểm bằng numpy
+    def __init__(self, chunks, a, avg_len):
+        self.chunks = chunks
+        self.tokens = _MappedStrings(a["tokens"], a["token_offsets"])
+        self.idf, self.post_offsets, self.post_chunk, self.post_tf = a["idf"], a["post_offsets"], a["post_chunk"], a["post_tf"]
+        self.norm = BM25_K1 * (1 - BM25_B + BM25_B * a["doc_len"] / avg_len) if avg_len else a["doc_len"]
+
+    def _row(self, token):
+        i = bisect_left(self.tokens, token)
+        return i if i < len(self.tokens) and self.tokens[i] == token else None
+
+    def search(self, query, top_k=5):
+        scores = np.zeros(len(self.chunks))
+        for token in set(tokenize(query)):
+            row = self._row(token)
+            if row is None: continue
+            lo, hi = int(self.post_offsets[row]), int(self.post_offsets[row + 1])
+            ids, tf = self.post_chunk[lo:hi], self.post_tf[lo:hi]
+            scores[ids] += self.idf[row] * tf * (BM25_K1 + 1) / (tf + self.norm[ids])
+        hits = np.flatnonzero(scores)
+        best = hits[np.argsort(-scores[hits], kind="stable")][:top_k]
+        return [(self.chunks[i], float(scores[i])) for i in best]
+
+class MappedCorpus:
+    # Kho tri thức chỉ đọc do build_kb.py dựng sẵn (không đọc PDF/DOCX, không tách từ khi khởi động)
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(KB_MAGIC)] != KB_MAGIC: raise ValueError(f"{path}: không phải file kho tri thức")
+        meta_len = int.from_bytes(self._mm[len(KB_MAGIC):len(KB_MAGIC) + 8], "little")
+        start = len(KB_MAGIC) + 8
+        meta = json.loads(self._mm[start:start + meta_len])
+        base = start + meta_len
+        a = {name: np.frombuffer(self._mm, dtype=np.dtype(dtype), count=count, offset=base + offset)
+             for name, (offset, dtype, count) in meta["sections"].items()}
+        self.stats = meta["stats"]
+        self.chunks = _MappedChunks(_MappedStrings(a["text"], a["text_offsets"]), [tuple(f) for f in meta["files"]],
+                                    a["chunk_file"], a["chunk_page"], a.get("owners"), a.get("owner_offsets"))
+        self.index = MappedIndex(self.chunks, a, meta["avg_len"])
@@ -0,0 +1,68 @@
+# =============================================================================
+# BACKEND AI (LLM): GEMINI THẬT HOẶC STUB OFFLINE (ĐỂ KIỂM THỬ TẢI, KHÔNG CẦN MẠNG)
+# =============================================================================
+
+import hashlib
+import re
+import time
+from abc import ABC, abstractmethod
+
+class LLMBackend(ABC):
+    # Giao diện chung: generate() trả về cả câu, stream() trả về từng đoạn.
+    # Backend thiếu generate() báo lỗi ngay khi khởi tạo, không đợi tới câu hỏi chat đầu tiên
+    name = "base"
+
+    @abstractmethod
+    def generate(self, prompt): ...
+
+    def stream(self, prompt):
+        yield self.generate(prompt)
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model_name="gemini-2.5-flash", api_key=None):
+        import google.generativeai as genai
+        if api_key: genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt):
+        return self.model.generate_content(prompt).text
+
+    def stream(self, prompt):
+        for part in self.model.generate_content(prompt, stream=True):
+            if part.text: yield part.text
+
+class StubBackend(LLMBackend):
+    # Trả lời xác định (cùng prompt -> cùng câu trả lời) với độ trễ giả lập
+    name = "stub"
+    _QUESTION_RE = re.compile(r"Câu hỏi:\s*(.*)", re.DOTALL)
+
+    def __init__(self, latency_ms=200, chunks=8):
+        self.latency = latency_ms / 1000
+        self.chunks = max(1, chunks)
+
+    def _answer(self, prompt):
+        match = self._QUESTION_RE.search(prompt)
+        question = match.group(1).strip() if match else ""
+        digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"[stub {digest}] Trả lời cho câu hỏi: {question}"
+
+    def generate(self, prompt):
+        time.sleep(self.latency)
+        return self._answer(prompt)
+
+    def stream(self, prompt):
+        # Chia độ trễ đều cho các đoạn: đoạn đầu tới sau latency/chunks
+        answer = self._answer(prompt)
+        size = -(-len(answer) // self.chunks)
+        for i in range(0, len(answer), size):
+            time.sleep(self.latency / self.chunks)
+            yield answer[i:i + size]
+
+def create_backend(name, **options):
+    # name: "gemini" | "stub". Lỗi khởi tạo Gemini -> None (giống hành vi cũ)
+    if name == "stub":
+        return StubBackend(options.get("latency_ms", 200), options.get("chunks", 8))
+    try: return GeminiBackend(options.get("model_name", "gemini-2.5-flash"), options.get("api_key"))
+    except Exception: return None
@@ -0,0 +1,165 @@
+# =============================================================================
+# CACHE CÂU TRẢ LỜI AI: LRU + TTL TRONG RAM, TẦNG SQLITE (TÙY CHỌN), GỘP REQUEST TRÙNG
+# =============================================================================
+
+import asyncio
+import hashlib
+import itertools
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from cachetools import TTLCache
+
+_SPACE_RE = re.compile(r"\s+")
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+def normalize_question(text):
+    # "Điều kiện tốt nghiệp  là gì???" -> "điều kiện tốt nghiệp là gì"
+    text = unicodedata.normalize("NFC", text.lower())
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text)).strip()
+
+def cache_key(question, context):
+    # Câu hỏi đã chuẩn hóa + dấu vân tay ngữ cảnh: tài liệu đổi -> khóa đổi
+    fingerprint = hashlib.sha1(context.encode("utf-8")).hexdigest()
+    return hashlib.sha1(f"{normalize_question(question)}|{fingerprint}".encode("utf-8")).hexdigest()
+
+class SqliteTier:
+    # Tầng lưu bền (sống qua restart, dùng chung giữa các worker cùng máy).
+    # Dòng hết hạn bị xóa khi khởi tạo và sau mỗi prune_every lần ghi -> file không phình mãi
+    def __init__(self, path, ttl, prune_every=100):
+        self.ttl, self.prune_every = ttl, max(1, prune_every)
+        self._local = threading.local()
+        self._puts = itertools.count(1) # next() nguyên tử với GIL, an toàn giữa các thread
+        self.path = path
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, answer TEXT, created_at REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_answers_created_at ON answers (created_at)")
+        self.prune()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT answer, created_at FROM answers WHERE key = ?", (key,)).fetchone()
+        if row and time.time() - row[1] < self.ttl: return row[0]
+        return None
+
+    def put(self, key, answer):
+        with self._conn() as conn:
+            conn.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?)", (key, answer, time.time()))
+        if next(self._puts) % self.prune_every == 0: self.prune()
+
+    def prune(self):
+        with self._conn() as conn:
+            return conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl,)).rowcount
+
+class AnswerCache:
+    def __init__(self, maxsize=2000, ttl=3600, db_path=None, max_concurrency=8):
+        self._memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._disk = SqliteTier(db_path, ttl) if db_path else None
+        self._inflight = {} # khóa -> Future của lời gọi AI đang chạy
+        self.max_concurrency = max_concurrency
+        self._limiter = None
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "coalesced": 0, "misses": 0}
+
+    @property
+    def limiter(self):
+        # Giới hạn số lời gọi AI đồng thời toàn tiến trình; phần vượt sẽ xếp hàng chờ
+        if self._limiter is None: self._limiter = asyncio.Semaphore(self.max_concurrency)
+        return self._limiter
+
+    def get_memory(self, key):
+        with self._lock: return self._memory.get(key)
+
+    async def get(self, key):
+        answer = self.get_memory(key)
+        if answer is not None:
+            self.stats["memory_hits"] += 1
+            return answer
+        if self._disk:
+            answer = await asyncio.get_running_loop().run_in_executor(None, self._disk.get, key)
+            if answer is not None:
+                self.stats["disk_hits"] += 1
+                with self._lock: self._memory[key] = answer
+                return answer
+        return None
+
+    async def put(self, key, answer):
+        with self._lock: self._memory[key] = answer
+        if self._disk: await asyncio.get_running_loop().run_in_executor(None, self._disk.put, key, answer)
+
+    async def get_or_compute(self, key, compute):
+        # compute: hàm async trả về câu trả lời. Lỗi không được cache.
+        answer = await self.get(key)
+        if answer is not None: return answer
+
+        # Câu hỏi giống hệt đang được xử lý -> chờ chung kết quả, không gọi AI lần 2
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(pending)
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            async with self.limiter: answer = await compute()
+            await self.put(key, answer)
+            future.set_result(answer)
+            return answer
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Đánh dấu đã xử lý khi không có ai chờ
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def stream_or_compute(self, key, stream):
+        # Bản streaming của get_or_compute. stream(): async iterator các mảnh câu trả lời.
+        # -> async iterator: người gọi AI nhận từng mảnh; cache hit / câu hỏi trùng đang stream nhận 1 mảnh trọn vẹn
+        answer = await self.get(key)
+        if answer is not None:
+            yield answer
+            return
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            yield await asyncio.shield(pending)
+            return
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        parts = []
+        try:
+            async with self.limiter:
+                async for part in stream():
+                    parts.append(part)
+                    yield part
+            answer = "".join(parts)
+            await self.put(key, answer)
+            future.set_result(answer)
+        except (asyncio.CancelledError, GeneratorExit):
+            # Client của người dẫn ngắt kết nối giữa chừng -> người đang chờ nhận lỗi thay vì treo
+            future.set_exception(ConnectionError("Stream bị ngắt giữa chừng"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
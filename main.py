@@ -3,31 +3,50 @@
 # =============================================================================
 
 import os
+import json
+import time
+import asyncio
+import secrets
+import threading
+from itertools import chain
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, List
+from types import SimpleNamespace
 
 # --- Thư viện Web & API ---
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Query, UploadFile, File, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 # --- Thư viện Database ---
-from sqlalchemy import create_engine, Column, String, Integer, Float, JSON, Boolean, ForeignKey
+from sqlalchemy import create_engine, event, func, select, Column, String, Integer, Float, JSON, Boolean, DateTime, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 
 # --- Thư viện Bảo mật ---
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+from cachetools import TTLCache, LRUCache
 
 # --- Thư viện AI & Xử lý dữ liệu ---
-import joblib 
 import pandas as pd
+import csv
+import io
+from openpyxl import load_workbook
 from dotenv import load_dotenv
-import google.generativeai as genai
-from pypdf import PdfReader 
-from docx import Document # (MỚI) Đọc file Word
+from llm_backend import create_backend # Gemini hoặc stub offline
+import knowledge_base as kb # Đọc PDF/DOCX, chia đoạn, chỉ mục BM25
+import recommender as rec # Chấm điểm gợi ý môn học từ ma trận SVD
+import degree_planner as planner # Lập kế hoạch học toàn khóa theo tiên quyết + trần tín chỉ
+from model_registry import ModelRegistry
+from llm_cache import AnswerCache, cache_key
+from metrics import Metrics, MetricsMiddleware # Đo thời gian từng chặng, xuất /metrics
+from audit_log import AuditLog, AuditMiddleware # Nhật ký request ghi theo lô ở nền
 
 # =============================================================================
 # 1. CẤU HÌNH HỆ THỐNG
@@ -36,13 +55,104 @@ from docx import Document # (MỚI) Đọc file Word
 SECRET_KEY = "bi_mat_khong_duoc_tiet_lo" 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 120 # Token sống 2 tiếng
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12")) # Độ khó bcrypt (mỗi +1 = chậm gấp đôi)
+# Cache thông tin đăng nhập & bảng điểm theo SV (giây / số mục tối đa)
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# RAG: số đoạn tài liệu tối đa & ngân sách ký tự ngữ cảnh cho mỗi câu hỏi
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "6"))
+RAG_CONTEXT_CHARS = int(os.getenv("RAG_CONTEXT_CHARS", "6000"))
+# Cache văn bản đã trích xuất & số tiến trình đọc song song (mặc định = số CPU)
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", ".doc_cache")
+DOC_EXTRACT_WORKERS = int(os.getenv("DOC_EXTRACT_WORKERS", "0")) or None
+DOC_WATCH = os.getenv("DOC_WATCH", "1") == "1" # Tự cập nhật kho tri thức khi thư mục documents/ thay đổi
+DOC_DEDUP = os.getenv("DOC_DEDUP", "1") == "1" # Bỏ khối văn bản mẫu lặp lại giữa các tài liệu
+# Kho tri thức dựng sẵn bởi build_kb.py (mở bằng mmap, mọi worker dùng chung); chưa có file -> tự đọc tài liệu
+KB_PATH = os.getenv("KB_PATH", os.path.join(".kb", "knowledge_base.kb"))
+# Thời gian sống của cache khung chương trình (giây) - để thấy thay đổi từ tiến trình khác
+CURRICULUM_CACHE_TTL = int(os.getenv("CURRICULUM_CACHE_TTL", "300"))
+# Kế hoạch học toàn khóa: số tín chỉ tối đa mỗi kỳ & số kế hoạch ghi nhớ (theo ngành + tập môn đã qua)
+PLAN_CREDIT_CAP = int(os.getenv("PLAN_CREDIT_CAP", "20"))
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "10000"))
+# Số lõi CPU cho RandomForest khi chấm điểm rủi ro theo lô (-1 = tất cả)
+RISK_N_JOBS = int(os.getenv("RISK_N_JOBS", "-1"))
+# Số môn gợi ý lưu sẵn cho mỗi sinh viên
+RECOMMEND_TOP_N = int(os.getenv("RECOMMEND_TOP_N", "5"))
+# Kho model: thư mục bản có phiên bản, mmap (chia sẻ RAM giữa worker), tự nạp lại khi file đổi
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+MODEL_MMAP_MODE = os.getenv("MODEL_MMAP_MODE", "r") or None
+MODEL_WATCH = os.getenv("MODEL_WATCH", "0") == "1"
+# Nạp sinh viên hàng loạt: số dòng mỗi transaction & số luồng băm mật khẩu bcrypt
+BULK_IMPORT_BATCH = int(os.getenv("BULK_IMPORT_BATCH", "1000"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 4)))
+# Số luồng bcrypt riêng cho đăng nhập / đăng ký (không xếp hàng sau các lô nạp SV)
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", str(os.cpu_count() or 4)))
+# Số lời gọi AI chạy song song tối đa
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "8"))
+# Cache câu trả lời AI: số câu giữ trong RAM, thời gian sống (giây), file SQLite lưu bền (trống = tắt)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "21600"))
+ANSWER_CACHE_DB = os.getenv("ANSWER_CACHE_DB", "")
+# METRICS_ENABLED=0: tắt đo (span thành nullcontext, không gắn middleware, /metrics trả 404)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS = Metrics(METRICS_ENABLED)
+# Nhật ký request (câu hỏi chat, yêu cầu tư vấn, độ trễ): hàng đợi RAM -> ghi lô ra JSONL xoay vòng
+AUDIT_ENABLED = os.getenv("AUDIT_ENABLED", "1") == "1"
+AUDIT = AuditLog(
+    os.getenv("AUDIT_LOG_PATH", os.path.join("logs", "audit.jsonl")),
+    batch_size=int(os.getenv("AUDIT_BATCH_SIZE", "500")), flush_interval=float(os.getenv("AUDIT_FLUSH_SECONDS", "1")),
+    max_queue=int(os.getenv("AUDIT_QUEUE_SIZE", "50000")), max_bytes=int(os.getenv("AUDIT_MAX_MB", "50")) * 1_000_000,
+    backups=int(os.getenv("AUDIT_BACKUPS", "10")), compress=os.getenv("AUDIT_COMPRESS", "1") == "1",
+    sample_every=int(os.getenv("AUDIT_SAMPLE_EVERY", "10")), # Quá tải (hàng đợi > 1/2): chỉ giữ 1/N bản ghi
+)
+
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=BCRYPT_ROUNDS, deprecated="auto")
+# bcrypt nhả GIL khi băm -> chạy song song thật trên nhiều lõi trong các thread pool này.
+# 2 pool tách biệt: nạp SV hàng loạt đẩy cả nghìn lần băm vào HASH_EXECUTOR mà đăng nhập không phải chờ
+HASH_EXECUTOR = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt-import")
+AUTH_EXECUTOR = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt-auth")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./vhu_secure.db"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+# --- Database: mặc định SQLite (WAL), đổi DB khác qua DATABASE_URL ---
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./vhu_secure.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1" # Bật engine async (cần aiosqlite / asyncpg)
+IS_SQLITE = SQLALCHEMY_DATABASE_URL.startswith("sqlite")
+
+def sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL: đọc không chặn ghi; NORMAL: đủ an toàn với WAL mà ít fsync hơn;
+    # busy_timeout: chờ khóa ghi thay vì báo lỗi "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def engine_options(url):
+    options = {"pool_pre_ping": True}
+    if url.startswith("sqlite"):
+        options["connect_args"] = {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+        if ":memory:" in url or url.rstrip("/").endswith(":"): return options # DB trong RAM: không dùng pool kích thước
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
+if IS_SQLITE: event.listen(engine, "connect", sqlite_pragmas)
+if METRICS_ENABLED: event.listen(engine, "before_cursor_execute", METRICS.count_db_query) # Đếm truy vấn mỗi request
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or \
+        SQLALCHEMY_DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+    if IS_SQLITE: event.listen(async_engine.sync_engine, "connect", sqlite_pragmas)
+    if METRICS_ENABLED: event.listen(async_engine.sync_engine, "before_cursor_execute", METRICS.count_db_query)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 # =============================================================================
@@ -60,7 +170,16 @@ class UserDB(Base):
     total_credits = Column(Integer, default=150) # Tổng tín chỉ cần học
     completed_credits = Column(Integer, default=0)
     gpa = Column(Float, default=0.0)
-    taken_subjects = Column(JSON, default={}) # Lưu điểm: {"CS101": 8.0}
+    taken_subjects = Column(JSON, default={}) # (Cũ) {"CS101": 8.0} - dữ liệu chuẩn nằm ở bảng grades
+
+class GradeDB(Base):
+    __tablename__ = "grades" # Mỗi dòng = 1 lần học 1 môn (học lại -> nhiều dòng)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    username = Column(String, index=True) # Mã SV
+    subject_id = Column(String)
+    term = Column(String, nullable=True) # Học kỳ, vd "2024-1" (dữ liệu cũ từ JSON: None)
+    score = Column(Float)
+    __table_args__ = (Index("ix_grades_subject_score", "subject_id", "score"),)
 
 class SubjectDB(Base):
     __tablename__ = "subjects"
@@ -81,6 +200,22 @@ class PrerequisiteDB(Base):
     subject_id = Column(String)
     prerequisite_id = Column(String)
 
+class RiskFeatureDB(Base):
+    __tablename__ = "risk_features" # Đặc trưng đầu vào của risk_predictor.pkl
+    username = Column(String, primary_key=True, index=True)
+    midterm_grade = Column(Float)
+    attendance_pct = Column(Float)
+    assignments_pct = Column(Float)
+    gpa_last_sem = Column(Float)
+
+class RiskScoreDB(Base):
+    __tablename__ = "risk_scores" # Kết quả chấm sẵn, đọc trực tiếp khi hiển thị
+    username = Column(String, primary_key=True, index=True)
+    major_id = Column(String, index=True)
+    risk = Column(Float, index=True) # Xác suất trượt (0-1)
+    model_version = Column(String)
+    scored_at = Column(DateTime)
+
 Base.metadata.create_all(bind=engine)
 
 def get_db():
@@ -88,69 +223,389 @@ def get_db():
     try: yield db
     finally: db.close()
 
+async def read_rows(stmt):
+    # Truy vấn đọc của đường nóng (đăng nhập, xác thực, /me).
+    # DB_ASYNC=1: chạy trên engine async, chờ I/O mà không giữ thread của threadpool;
+    # ngược lại: phiên đồng bộ chạy trong threadpool như trước
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as db: return (await db.execute(stmt)).all()
+    def run():
+        with SessionLocal() as db: return db.execute(stmt).all()
+    return await run_in_threadpool(run)
+
+# --- Cache theo sinh viên (phiên đăng nhập, bảng điểm): LRU + TTL, xóa khi dữ liệu SV đổi ---
+class UserCache:
+    def __init__(self, maxsize, ttl):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock() # cachetools không an toàn đa luồng
+
+    def get(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+        return entry[1] if entry else None
+
+    def set(self, key, username, value):
+        with self._lock: self._cache[key] = (username, value)
+
+    def invalidate(self, usernames=None):
+        # usernames=None -> xóa toàn bộ
+        with self._lock:
+            if usernames is None: self._cache.clear(); return
+            for key in [k for k, (u, _) in list(self._cache.items()) if u in usernames]:
+                self._cache.pop(key, None)
+
+PRINCIPAL_CACHE = UserCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)  # token -> (thông tin SV, hạn token)
+TRANSCRIPT_CACHE = UserCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL) # mã SV -> bảng điểm
+
+@event.listens_for(Session, "after_flush")
+def _track_user_changes(session, flush_context):
+    changed = session.info.setdefault("users_changed", set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, (UserDB, GradeDB)): changed.add(obj.username)
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_user_bulk(orm_execute_state):
+    if orm_execute_state.is_select: return
+    if any(m.class_ in (UserDB, GradeDB) for m in orm_execute_state.all_mappers):
+        orm_execute_state.session.info["users_changed_all"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_user_caches(session):
+    changed = session.info.pop("users_changed", None)
+    if session.info.pop("users_changed_all", False): changed = None
+    elif not changed: return
+    PRINCIPAL_CACHE.invalidate(changed)
+    TRANSCRIPT_CACHE.invalidate(changed)
+
+@event.listens_for(Session, "after_rollback")
+def _reset_user_changes(session):
+    session.info.pop("users_changed", None); session.info.pop("users_changed_all", None)
+
+# --- Bảng điểm chuẩn hóa (grades) ---
+PASS_SCORE = 5.0
+
+def transcript_query(username: str):
+    return select(GradeDB.subject_id, func.max(GradeDB.score)).where(GradeDB.username == username).group_by(GradeDB.subject_id)
+
+def load_transcript(db: Session, username: str):
+    # {mã môn: điểm cao nhất} - 1 truy vấn theo chỉ mục username (có cache)
+    transcript = TRANSCRIPT_CACHE.get(username)
+    if transcript is not None: return transcript
+    transcript = dict(db.execute(transcript_query(username)).all())
+    TRANSCRIPT_CACHE.set(username, username, transcript)
+    return transcript
+
+async def load_transcript_async(username: str):
+    # Như load_transcript nhưng cho endpoint async (engine async khi DB_ASYNC=1)
+    transcript = TRANSCRIPT_CACHE.get(username)
+    if transcript is not None: return transcript
+    transcript = dict(await read_rows(transcript_query(username)))
+    TRANSCRIPT_CACHE.set(username, username, transcript)
+    return transcript
+
+def load_all_transcripts(db: Session, major_id: Optional[str] = None):
+    # {mã SV: {mã môn: điểm cao nhất}} cho toàn trường (hoặc 1 ngành), đọc thẳng từ bảng grades
+    transcripts = {}
+    rows = db.query(GradeDB.username, GradeDB.subject_id, func.max(GradeDB.score))
+    if major_id: rows = rows.join(UserDB, UserDB.username == GradeDB.username).filter(UserDB.major_id == major_id)
+    rows = rows.group_by(GradeDB.username, GradeDB.subject_id)
+    for username, code, score in rows.yield_per(5000):
+        transcripts.setdefault(username, {})[code] = score
+    return transcripts
+
+def migrate_grades_from_json():
+    # Chuyển điểm trong cột JSON users.taken_subjects sang bảng grades (chỉ chạy khi grades còn trống).
+    # Bước migrate chạy 1 lần bằng init_data.py, không chạy khi import: nhiều worker cùng khởi động
+    # sẽ cùng thấy grades trống và chèn trùng.
+    db = SessionLocal()
+    try:
+        if db.query(GradeDB.id).first() is not None: return 0
+        rows = []
+        for username, taken in db.query(UserDB.username, UserDB.taken_subjects).yield_per(1000):
+            if not isinstance(taken, dict): continue # Dạng list cũ không có điểm
+            rows += [{"username": username, "subject_id": code, "term": None, "score": float(score)}
+                     for code, score in taken.items()]
+        if rows:
+            db.bulk_insert_mappings(GradeDB, rows)
+            db.commit()
+            print(f"--- 🔁 Đã chuyển {len(rows)} điểm từ users.taken_subjects sang bảng grades ---")
+        return len(rows)
+    finally: db.close()
+
+# --- Cache khung chương trình: đồ thị môn học / tiên quyết theo ngành (trong RAM) ---
+class CurriculumGraph:
+    def __init__(self, curriculum_rows, prereq_rows, subject_rows):
+        self.semesters = {}  # major_id -> {semester: [subject_id]}
+        self.prereqs = {}    # subject_id -> {prerequisite_id}
+        self.subjects = {}   # subject_id -> (tên môn, số tín chỉ)
+        for major_id, sem, subject_id in curriculum_rows:
+            self.semesters.setdefault(major_id, {}).setdefault(sem, []).append(subject_id)
+        for subject_id, prereq_id in prereq_rows:
+            self.prereqs.setdefault(subject_id, set()).add(prereq_id)
+        for subject_id, name, credits in subject_rows:
+            self.subjects[subject_id] = (name, credits)
+        self.credits = {code: credits or 0 for code, (_, credits) in self.subjects.items()}
+        self.built_at = time.monotonic()
+        self._plans = LRUCache(maxsize=PLAN_CACHE_SIZE) # Mất cùng đồ thị khi khung chương trình đổi
+        self._plans_lock = threading.Lock()
+
+    def subjects_for_semester(self, major_id, sem, passed):
+        # Môn của kỳ `sem` chưa qua và đã đủ tiên quyết (passed: tập môn đã qua)
+        valid_subjects = []
+        for code in self.semesters.get(major_id, {}).get(sem, []):
+            if code in passed: continue
+            if not self.prereqs.get(code, set()) <= passed: continue
+            name = self.subjects.get(code, ("Môn học", 0))[0]
+            valid_subjects.append({"code": code, "name": name})
+        return valid_subjects
+
+    def plan(self, major_id, passed, credit_cap=PLAN_CREDIT_CAP):
+        # Ghi nhớ theo (ngành, tập môn đã qua, trần tín chỉ): SV cùng tiến độ dùng chung 1 kết quả
+        key = (major_id, passed, credit_cap)
+        with self._plans_lock: plan = self._plans.get(key)
+        if plan is None:
+            plan = planner.plan_degree(self.semesters.get(major_id, {}), self.prereqs, self.credits, passed, credit_cap)
+            with self._plans_lock: self._plans[key] = plan
+        return plan
+
+    def describe_plan(self, plan, completed_credits, total_credits):
+        # Kế hoạch (mã môn) -> dạng trả về API, kèm tín chỉ tích lũy dự kiến so với tổng cần học
+        semesters = [{"semester": i, "credits": sum(self.credits.get(c, 0) for c in codes),
+                      "subjects": [{"code": c, "name": self.subjects.get(c, ("Môn học", 0))[0], "credits": self.credits.get(c, 0)}
+                                   for c in codes]}
+                     for i, codes in enumerate(plan["semesters"], 1)]
+        planned = sum(s["credits"] for s in semesters)
+        return {
+            "semesters": semesters, "total_semesters": len(semesters),
+            "lower_bound": plan["lower_bound"], "optimal": plan["optimal"], "blocked": plan["blocked"],
+            "planned_credits": planned, "projected_credits": completed_credits + planned,
+            "missing_credits": max(0, total_credits - completed_credits - planned), # Phần khung CT chưa phủ (tự chọn...)
+        }
+
+CURRICULUM_MODELS = (SubjectDB, CurriculumDB, PrerequisiteDB)
+_curriculum_graph = None
+_curriculum_lock = threading.Lock()
+
+def get_curriculum_graph():
+    # Nạp 1 lần (3 truy vấn cho toàn bộ dữ liệu), sau đó mọi request chỉ đọc RAM
+    global _curriculum_graph
+    graph = _curriculum_graph
+    if graph and time.monotonic() - graph.built_at < CURRICULUM_CACHE_TTL: return graph
+    with _curriculum_lock:
+        graph = _curriculum_graph
+        if graph and time.monotonic() - graph.built_at < CURRICULUM_CACHE_TTL: return graph
+        db = SessionLocal()
+        try:
+            graph = CurriculumGraph(
+                db.query(CurriculumDB.major_id, CurriculumDB.semester, CurriculumDB.subject_id).all(),
+                db.query(PrerequisiteDB.subject_id, PrerequisiteDB.prerequisite_id).all(),
+                db.query(SubjectDB.subject_id, SubjectDB.subject_name, SubjectDB.credits).all(),
+            )
+        finally: db.close()
+        _curriculum_graph = graph # Đổi tham chiếu nguyên tử, request đang chạy vẫn dùng bản cũ
+        return graph
+
+def invalidate_curriculum_graph():
+    global _curriculum_graph
+    _curriculum_graph = None
+
+# Tự xóa cache khi phiên DB commit thay đổi vào các bảng môn học / khung CT / tiên quyết
+@event.listens_for(Session, "after_flush")
+def _track_curriculum_flush(session, flush_context):
+    if any(isinstance(o, CURRICULUM_MODELS) for o in chain(session.new, session.dirty, session.deleted)):
+        session.info["curriculum_dirty"] = True
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_curriculum_bulk(orm_execute_state):
+    if orm_execute_state.is_select: return
+    if any(m.class_ in CURRICULUM_MODELS for m in orm_execute_state.all_mappers):
+        orm_execute_state.session.info["curriculum_dirty"] = True
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_curriculum_on_commit(session):
+    if session.info.pop("curriculum_dirty", False): invalidate_curriculum_graph()
+
 # =============================================================================
 # 3. CẤU HÌNH AI & RAG (ĐỌC PDF + DOCX)
 # =============================================================================
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
-if GOOGLE_API_KEY: genai.configure(api_key=GOOGLE_API_KEY)
-try: gemini_model = genai.GenerativeModel('gemini-2.5-flash')
-except: gemini_model = None
+# LLM_BACKEND=stub: trả lời giả lập offline (độ trễ STUB_LLM_LATENCY_MS) để đo tải không cần mạng
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")
+llm = create_backend(
+    LLM_BACKEND, model_name=os.getenv("GEMINI_MODEL", "gemini-2.5-flash"), api_key=GOOGLE_API_KEY,
+    latency_ms=int(os.getenv("STUB_LLM_LATENCY_MS", "200")), chunks=int(os.getenv("STUB_LLM_CHUNKS", "8")),
+)
+# Thread pool giới hạn cho lời gọi AI (SDK Gemini là đồng bộ)
+LLM_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm")
+# Cache + gộp câu hỏi trùng đang xử lý + giới hạn số lời gọi AI đồng thời (xếp hàng khi quá tải)
+ANSWER_CACHE = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_DB or None, LLM_MAX_WORKERS)
+
+# Kho tri thức hiện hành (kb.Corpus bất biến). Cập nhật = tạo bản mới rồi gán lại CORPUS,
+# request đang chạy vẫn đọc trọn vẹn bản cũ
+DOC_ROOT = "documents"
+CORPUS = kb.Corpus({}, DOC_DEDUP)
+CORPUS_LOCK = threading.Lock() # Mỗi lần chỉ 1 luồng dựng bản mới
 
-# Biến toàn cục lưu nội dung tài liệu
-PDF_CONTENT = ""
+def extract_documents(paths, workers=DOC_EXTRACT_WORKERS):
+    # -> {đường dẫn: phần tài liệu}. Chỉ đọc lại file mới/đã sửa, phần còn lại lấy từ cache trên đĩa
+    entries, errors, parsed = kb.extract_entries(paths, DOC_ROOT, DOC_CACHE_DIR, workers)
+    print(f"   ⚡ Cache: {len(paths) - parsed} file dùng lại, {parsed} file đọc mới")
+    for file_path, error in errors.items(): print(f"   ❌ [Lỗi] {os.path.basename(file_path)}: {error}")
+    for entry in entries.values(): print(f"   ✅ [Đã đọc] {entry['category']}/{entry['filename']}")
+    return entries
 
 def load_documents():
-    global PDF_CONTENT
-    root_folder = "documents"
-    print(f"--- 📂 Đang quét tài liệu (PDF & DOCX) trong '{root_folder}'... ---")
+    global CORPUS
+    # Có kho dựng sẵn (python build_kb.py) -> mở bằng mmap, không đọc lại tài liệu
+    if KB_PATH and os.path.exists(KB_PATH):
+        with METRICS.startup_phase("documents_mmap"): CORPUS = kb.MappedCorpus(KB_PATH)
+        print(f"--- ⚡ Mở kho tri thức dựng sẵn '{KB_PATH}' (mmap): {len(CORPUS.chunks)} đoạn ---")
+        return
+
+    print(f"--- 📂 Đang quét tài liệu (PDF & DOCX) trong '{DOC_ROOT}'... ---")
     
-    if not os.path.exists(root_folder):
-        print(f"⚠️ Cảnh báo: Không tìm thấy thư mục '{root_folder}'")
+    if not os.path.exists(DOC_ROOT):
+        print(f"⚠️ Cảnh báo: Không tìm thấy thư mục '{DOC_ROOT}'")
         return
 
-    # Quét đệ quy (Recursive scan) mọi thư mục con
-    for current_root, dirs, files in os.walk(root_folder):
-        category = os.path.basename(current_root)
-        if category == "documents": category = "CHUNG"
-        
-        for filename in files:
-            file_path = os.path.join(current_root, filename)
-            text_file = ""
-            try:
-                # Đọc PDF
-                if filename.endswith('.pdf'):
-                    reader = PdfReader(file_path)
-                    for page in reader.pages:
-                        t = page.extract_text()
-                        if t: text_file += t + "\n"
-                        
-                # Đọc DOCX (Word)
-                elif filename.endswith('.docx'):
-                    doc = Document(file_path)
-                    for para in doc.paragraphs:
-                        text_file += para.text + "\n"
-                
-                if text_file:
-                    PDF_CONTENT += f"\n========================================\n"
-                    PDF_CONTENT += f"📂 DANH MỤC: {category.upper()} | 📄 TÀI LIỆU: {filename}\n"
-                    PDF_CONTENT += f"========================================\n"
-                    PDF_CONTENT += f"{text_file}\n"
-                    print(f"   ✅ [Đã đọc] {category}/{filename}")
-                    
-            except Exception as e:
-                print(f"   ❌ [Lỗi] {filename}: {e}")
-
-    print(f"--- ✅ Hoàn tất! Tổng dữ liệu tri thức: {len(PDF_CONTENT)} ký tự ---")
-
-load_documents()
-
-# Tải Model ML
-try: recommender_model = joblib.load('course_recommender.pkl')
-except: recommender_model = None
-try: risk_model = joblib.load('risk_predictor.pkl')
-except: risk_model = None
+    with METRICS.startup_phase("documents_scan"): found = kb.scan_documents(DOC_ROOT)
+    with METRICS.startup_phase("documents_extract"): entries = extract_documents(found)
+    with METRICS.startup_phase("documents_index"): CORPUS = kb.Corpus(entries, DOC_DEDUP)
+    stats = CORPUS.stats
+    print(f"   🧹 Lọc trùng: {stats['shared_blocks']}/{stats['blocks']} khối dùng chung, "
+          f"{stats['original_chars']} -> {stats['stored_chars']} ký tự (nén x{stats['compression_ratio']})")
+    print(f"--- ✅ Hoàn tất! Tổng dữ liệu tri thức: {len(CORPUS.text)} ký tự, {len(CORPUS.chunks)} đoạn ---")
+
+def reindex_documents(paths):
+    # Chỉ đọc lại các file vừa đổi; file đã xóa (hoặc không còn đọc được) bị gỡ khỏi kho
+    global CORPUS
+    paths = {os.path.relpath(p) for p in paths}
+    with CORPUS_LOCK:
+        # Đọc ngay trong thread này (workers=1): server đang chạy nhiều thread + kết nối DB mở, fork process pool
+        # từ đây có thể treo tiến trình con; mỗi lần thường chỉ 1-2 file đổi
+        entries = extract_documents(sorted(p for p in paths if os.path.isfile(p)), workers=1)
+        removed = (paths - set(entries)) & set(CORPUS.documents)
+        CORPUS = CORPUS.replace(entries, removed)
+    return sorted(entries), sorted(removed)
+
+async def watch_documents(stop_event: asyncio.Event):
+    # Theo dõi thư mục tài liệu: thêm/sửa/xóa PDF, DOCX là cập nhật kho tri thức (không restart server)
+    from watchfiles import awatch
+    def is_document(change, path): return path.endswith(kb.DOC_EXTENSIONS)
+    async for changes in awatch(DOC_ROOT, watch_filter=is_document, stop_event=stop_event):
+        try:
+            updated, removed = await asyncio.get_running_loop().run_in_executor(
+                None, reindex_documents, {path for _, path in changes})
+        except Exception as e:
+            print(f"⚠️ Lỗi cập nhật tài liệu: {e}")
+            continue
+        print(f"--- 🔄 Cập nhật tài liệu: {len(updated)} file đọc lại, {len(removed)} file gỡ bỏ, "
+              f"{len(CORPUS.chunks)} đoạn ---")
+
+async def watch_knowledge_base(stop_event: asyncio.Event):
+    # Chế độ kho dựng sẵn: build_kb.py thay file (nguyên tử) -> mở lại bằng mmap, request cũ vẫn đọc bản cũ
+    global CORPUS
+    from watchfiles import awatch
+    target = os.path.abspath(KB_PATH)
+    def is_kb(change, path): return path == target
+    async for changes in awatch(os.path.dirname(target), watch_filter=is_kb, stop_event=stop_event):
+        if not os.path.exists(KB_PATH): continue
+        try: CORPUS = kb.MappedCorpus(KB_PATH)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Lỗi mở kho tri thức: {e}")
+            continue
+        print(f"--- 🔄 Đã mở lại kho tri thức dựng sẵn: {len(CORPUS.chunks)} đoạn ---")
+
+with METRICS.startup_phase("documents_total"): load_documents()
+
+# Tải Model ML (qua registry: nạp lười, đổi nóng khi huấn luyện lại)
+MODELS = ModelRegistry(MODEL_DIR, MODEL_MMAP_MODE)
+MODELS.register("course_recommender", "course_recommender.pkl", prepare=rec.svd_factors)
+MODELS.register("risk_predictor", "risk_predictor.pkl")
+
+# --- Chấm điểm rủi ro theo lô (cả khóa / cả ngành trong 1 lần predict_proba) ---
+RISK_FEATURES = ['midterm_grade', 'attendance_pct', 'assignments_pct', 'gpa_last_sem']
+
+def replace_rows(db: Session, model, rows, batch=500):
+    # Ghi đè các dòng theo khóa username: xóa dòng cũ theo lô `batch` tên (giới hạn tham số IN) rồi chèn hàng loạt.
+    # Chưa commit -> người gọi quyết định transaction
+    names = [r["username"] for r in rows]
+    for i in range(0, len(names), batch):
+        db.query(model).filter(model.username.in_(names[i:i + batch])).delete(synchronize_session=False)
+    db.bulk_insert_mappings(model, rows)
+
+def score_risk_cohort(db: Session, major_id: Optional[str] = None, usernames: Optional[List[str]] = None):
+    entry = MODELS.get("risk_predictor") # Giữ 1 phiên bản cho cả lô dù model bị đổi giữa chừng
+    if entry is None: raise RuntimeError("Chưa có model dự báo rủi ro (risk_predictor.pkl)")
+    risk_model = entry.model
+    query = db.query(UserDB.username, UserDB.major_id, *[getattr(RiskFeatureDB, f) for f in RISK_FEATURES]) \
+        .join(RiskFeatureDB, RiskFeatureDB.username == UserDB.username)
+    if major_id: query = query.filter(UserDB.major_id == major_id)
+    if usernames: query = query.filter(UserDB.username.in_(usernames))
+    rows = query.all()
+    if not rows: return {"scored": 0, "model_version": entry.version}
+
+    # 1 ma trận đặc trưng cho cả lô -> 1 lần predict_proba song song n_jobs
+    X = pd.DataFrame([r[2:] for r in rows], columns=RISK_FEATURES).fillna(0.0)
+    risk_model.n_jobs = RISK_N_JOBS
+    probs = risk_model.predict_proba(X)[:, list(risk_model.classes_).index(1)]
+
+    now = datetime.utcnow()
+    scores = [{"username": r[0], "major_id": r[1], "risk": float(p), "model_version": entry.version, "scored_at": now}
+              for r, p in zip(rows, probs)]
+    replace_rows(db, RiskScoreDB, scores) # Ghi đè kết quả cũ
+    db.commit()
+    return {"scored": len(scores), "model_version": entry.version}
+
+# --- Gợi ý môn học: bảng top-N tính sẵn cho mọi sinh viên ---
+RECOMMENDATIONS = {} # mã SV -> (tập môn đã qua, [{"code", "name", "score"}])
+
+def passed_subjects(transcript):
+    return frozenset(code for code, score in (transcript or {}).items() if score >= PASS_SCORE)
+
+def compute_recommendations(users, entry=None):
+    # users: [(mã SV, bảng điểm)] -> {mã SV: (tập môn đã qua, danh sách gợi ý)}
+    entry = entry or MODELS.get("course_recommender")
+    if entry is None or not users: return {}
+    graph = get_curriculum_graph()
+    usernames = [u for u, _ in users]
+    passed = [passed_subjects(t) for _, t in users]
+    table = rec.top_n(entry.prepared, usernames, passed, graph.prereqs, RECOMMEND_TOP_N)
+    return {
+        u: (p, [{"code": code, "name": graph.subjects.get(code, ("Môn học", 0))[0], "score": round(score, 2)}
+                for code, score in table[u]])
+        for u, p in zip(usernames, passed)
+    }
+
+def refresh_recommendations(entry=None):
+    # Tính lại toàn bộ rồi đổi tham chiếu 1 lần (request đang đọc không thấy bảng dở dang)
+    global RECOMMENDATIONS
+    db = SessionLocal()
+    try:
+        transcripts = load_all_transcripts(db)
+        users = [(u, transcripts.get(u, {})) for (u,) in db.query(UserDB.username)]
+    finally: db.close()
+    RECOMMENDATIONS = compute_recommendations(users, entry)
+    return len(RECOMMENDATIONS)
+
+# Model gợi ý đổi phiên bản -> tính lại bảng top-N theo model mới
+MODELS.on_swap("course_recommender", refresh_recommendations)
+
+async def watch_models(stop_event: asyncio.Event):
+    # Theo dõi file .pkl, huấn luyện lại xong là tự nạp model mới (không restart server).
+    # Chỉ theo dõi MODEL_DIR + đúng các file gốc (không theo dõi cả thư mục dự án: .doc_cache, logs...)
+    from watchfiles import awatch, Change
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    def is_model(change, path): return path.endswith(".pkl") and MODELS.name_for_path(path) is not None
+    while not stop_event.is_set():
+        paths = [p for p in MODELS.watched_paths() if os.path.exists(p)]
+        async for changes in awatch(*paths, watch_filter=is_model, stop_event=stop_event):
+            for name in {MODELS.name_for_path(path) for _, path in changes}:
+                await asyncio.get_running_loop().run_in_executor(None, MODELS.reload, name)
+            # File gốc bị thay bằng os.replace -> inode cũ mất theo dõi, đăng ký lại với file mới
+            if any(change == Change.deleted for change, _ in changes): break
 
 # =============================================================================
 # 4. CÁC HÀM XỬ LÝ BẢO MẬT
@@ -168,30 +623,180 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def user_snapshot(row):
+    # Bản sao chỉ đọc các cột của users -> dùng lại được giữa các request/phiên DB
+    return SimpleNamespace(**row._mapping)
+
+async def get_current_user(token: str = Depends(oauth2_scheme)):
+    # Cache hit: không decode JWT, không truy vấn DB
+    with METRICS.span("auth.cache"): cached = PRINCIPAL_CACHE.get(token)
+    if cached and cached[1] > time.time():
+        AUDIT.annotate(user=cached[0].username, role=cached[0].role)
+        return cached[0]
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Token không hợp lệ", headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        with METRICS.span("auth.jwt"): payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None: raise credentials_exception
     except JWTError: raise credentials_exception
         
-    user = db.query(UserDB).filter(UserDB.username == username).first()
-    if user is None: raise credentials_exception
+    with METRICS.span("auth.db"):
+        rows = await read_rows(select(*UserDB.__table__.columns).where(UserDB.username == username))
+    if not rows: raise credentials_exception
+    user = user_snapshot(rows[0])
+    PRINCIPAL_CACHE.set(token, username, (user, payload["exp"]))
+    AUDIT.annotate(user=username, role=user.role)
     return user
 
+STAFF_ROLES = ("admin", "advisor")
+
+async def get_current_staff(current_user: UserDB = Depends(get_current_user)):
+    # Chỉ cố vấn học tập / quản trị viên được xem dữ liệu cả khóa
+    if current_user.role not in STAFF_ROLES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Không có quyền truy cập")
+    return current_user
+
+# --- Nạp sinh viên hàng loạt (Excel/CSV) ---
+# Cột của file: masv, hoten, nganh, tinchi_tichluy, gpa, mon_da_hoc ("CS101:8.5,MA101"), matkhau (tùy chọn)
+# Không có matkhau -> SV mới nhận mật khẩu ngẫu nhiên dùng 1 lần, trả về trong báo cáo (không bao giờ dùng mã SV)
+IMPORT_REQUIRED_COLUMNS = ("masv", "hoten")
+# Giá trị cho SV mới khi file không có cột tương ứng (SV đã có: cột thiếu giữ nguyên giá trị cũ)
+NEW_STUDENT_DEFAULTS = {"major_id": "CNTT", "completed_credits": 0, "gpa": 0.0, "taken_subjects": []}
+
+def iter_student_rows(file_obj, filename):
+    # Đọc lần lượt từng dòng (không nạp cả file vào RAM) -> (số dòng, {cột: giá trị})
+    if filename.lower().endswith(".csv"):
+        reader = csv.reader(io.TextIOWrapper(file_obj, encoding="utf-8-sig"))
+    else:
+        wb = load_workbook(file_obj, read_only=True, data_only=True)
+        reader = wb.active.iter_rows(values_only=True)
+    header = [str(c).strip().lower() if c is not None else "" for c in next(reader, [])]
+    missing = [c for c in IMPORT_REQUIRED_COLUMNS if c not in header]
+    if missing: raise ValueError(f"Thiếu cột: {', '.join(missing)}")
+    for line_no, values in enumerate(reader, 2):
+        if not any(v not in (None, "") for v in values): continue
+        yield line_no, dict(zip(header, values))
+
+def parse_student_row(row):
+    # -> (dữ liệu users (chỉ các cột có giá trị), mật khẩu ban đầu (None nếu file không có), {mã môn: điểm})
+    username = str(row.get("masv") or "").strip()
+    full_name = str(row.get("hoten") or "").strip()
+    if not username or not full_name: raise ValueError("Thiếu mã SV hoặc họ tên")
+    grades, no_score = {}, []
+    for item in str(row.get("mon_da_hoc") or "").split(","):
+        code, _, score = item.strip().partition(":")
+        if not code: continue
+        if score.strip(): grades[code] = float(score)
+        else: no_score.append(code)
+    # Chỉ ghi cột có trong file và ô không trống -> nạp lại file thiếu cột không xóa dữ liệu cũ
+    def given(column): return str(row.get(column) or "").strip() != ""
+    user = {"username": username, "full_name": full_name}
+    if given("nganh"): user["major_id"] = str(row["nganh"]).strip()
+    if given("tinchi_tichluy"): user["completed_credits"] = int(float(row["tinchi_tichluy"]))
+    if given("gpa"): user["gpa"] = float(row["gpa"])
+    # Môn chỉ có mã (không có điểm) giữ ở cột JSON cũ như trước đây
+    if given("mon_da_hoc"): user["taken_subjects"] = grades or no_score
+    return user, str(row.get("matkhau") or "").strip() or None, grades
+
+def import_student_batch(db: Session, batch):
+    # batch: [(số dòng, user, mật khẩu, điểm)] -> 1 transaction cho cả lô
+    usernames = [u["username"] for _, u, _, _ in batch]
+    existing = dict(db.query(UserDB.username, UserDB.id).filter(UserDB.username.in_(usernames)))
+    new, generated = [], [] # generated: mật khẩu ngẫu nhiên cấp cho SV mới không có cột matkhau
+    for _, u, pw, _ in batch:
+        if u["username"] in existing: continue
+        if not pw:
+            pw = secrets.token_urlsafe(9)
+            generated.append({"student_id": u["username"], "password": pw})
+        new.append((u, pw))
+    hashes = list(HASH_EXECUTOR.map(get_password_hash, [pw for _, pw in new]))
+    db.bulk_insert_mappings(UserDB, [dict(NEW_STUDENT_DEFAULTS, **u, hashed_password=h) for (u, _), h in zip(new, hashes)])
+    # SV đã có: chỉ cập nhật các cột có trong file, giữ nguyên mật khẩu
+    db.bulk_update_mappings(UserDB, [dict(u, id=existing[u["username"]]) for _, u, _, _ in batch if u["username"] in existing])
+    # Chỉ thay điểm (không có học kỳ) của SV mà dòng trong file thực sự có điểm
+    graded = [u["username"] for _, u, _, grades in batch if grades]
+    if graded:
+        db.query(GradeDB).filter(GradeDB.username.in_(graded), GradeDB.term.is_(None)).delete(synchronize_session=False)
+        db.bulk_insert_mappings(GradeDB, [
+            {"username": u["username"], "subject_id": code, "term": None, "score": score}
+            for _, u, _, grades in batch for code, score in grades.items()
+        ])
+    # Câu DELETE hàng loạt ở trên bật cờ "xóa toàn bộ cache"; lô này biết chính xác SV bị đổi -> chỉ xóa cache của họ,
+    # không đẩy mọi SV đang đăng nhập ra khỏi cache ở mỗi lô
+    db.info.pop("users_changed_all", None)
+    db.commit()
+    PRINCIPAL_CACHE.invalidate(set(usernames)) # bulk_*_mappings không qua sự kiện flush
+    TRANSCRIPT_CACHE.invalidate(set(usernames))
+    return len(new), len(batch) - len(new), generated
+
+def import_students(db: Session, rows):
+    # rows: iterator (số dòng, {cột: giá trị}). Lỗi từng dòng được ghi lại, không dừng cả file.
+    report = {"created": 0, "updated": 0, "errors": [], "passwords": []}
+    batch, seen = [], set()
+    def flush():
+        try:
+            created, updated, generated = import_student_batch(db, batch)
+            report["created"] += created; report["updated"] += updated; report["passwords"] += generated
+        except Exception as e:
+            db.rollback()
+            report["errors"] += [{"row": n, "student_id": u["username"], "error": f"Lỗi ghi lô: {e}"} for n, u, _, _ in batch]
+        batch.clear(); seen.clear()
+    for line_no, row in rows:
+        try:
+            user, password, grades = parse_student_row(row)
+            if user["username"] in seen: raise ValueError("Trùng mã SV trong cùng file")
+        except Exception as e:
+            report["errors"].append({"row": line_no, "student_id": row.get("masv"), "error": str(e)})
+            continue
+        seen.add(user["username"])
+        batch.append((line_no, user, password, grades))
+        if len(batch) >= BULK_IMPORT_BATCH: flush()
+    if batch: flush()
+    return report
+
 # =============================================================================
 # 5. KHỞI TẠO APP & API
 # =============================================================================
 
-app = FastAPI(title="VHU AI Assistant - Full Version")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Khởi động: tính sẵn bảng gợi ý môn học (chạy ngoài event loop)
+    await asyncio.get_running_loop().run_in_executor(None, refresh_recommendations)
+    stop_event = asyncio.Event()
+    watchers = [asyncio.create_task(watch_models(stop_event))] if MODEL_WATCH else []
+    if AUDIT_ENABLED: watchers.append(asyncio.create_task(AUDIT.run(stop_event)))
+    if DOC_WATCH and isinstance(CORPUS, kb.MappedCorpus):
+        watchers.append(asyncio.create_task(watch_knowledge_base(stop_event)))
+    elif DOC_WATCH and os.path.isdir(DOC_ROOT):
+        watchers.append(asyncio.create_task(watch_documents(stop_event)))
+    yield
+    stop_event.set()
+    for watcher in watchers: await watcher
+
+app = FastAPI(title="VHU AI Assistant - Full Version", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware, allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
 )
+if METRICS_ENABLED: app.add_middleware(MetricsMiddleware, metrics=METRICS)
+if AUDIT_ENABLED: app.add_middleware(AuditMiddleware, audit=AUDIT)
+
+def cache_metrics():
+    # Thống kê cache (đếm dồn) theo định dạng Prometheus
+    lines = ["# HELP vhu_answer_cache_total Số lần tra cache câu trả lời AI theo kết quả", "# TYPE vhu_answer_cache_total counter"]
+    lines += [f'vhu_answer_cache_total{{result="{k}"}} {v}' for k, v in ANSWER_CACHE.stats.items()]
+    lines += ["# HELP vhu_documents_chunks Số đoạn tài liệu trong chỉ mục RAG", "# TYPE vhu_documents_chunks gauge", f"vhu_documents_chunks {len(CORPUS.chunks)}"]
+    lines += ["# HELP vhu_audit_records_total Bản ghi nhật ký request theo trạng thái", "# TYPE vhu_audit_records_total counter"]
+    lines += [f'vhu_audit_records_total{{state="{k}"}} {v}' for k, v in AUDIT.stats.items()]
+    lines += ["# HELP vhu_documents_compression_ratio Tỉ lệ ký tự gốc / ký tự còn lại sau khi lọc trùng", "# TYPE vhu_documents_compression_ratio gauge",
+              f"vhu_documents_compression_ratio {CORPUS.stats['compression_ratio']}"]
+    return lines
+
+METRICS.add_collector(cache_metrics)
 
 class UserCreate(BaseModel):
     username: str 
@@ -205,77 +810,87 @@ class AdviceRequest(BaseModel):
 class ChatRequest(BaseModel):
     message: str
 
+class RiskFeatures(BaseModel):
+    username: str
+    midterm_grade: float
+    attendance_pct: float
+    assignments_pct: float
+    gpa_last_sem: float
+
+class RiskBatchRequest(BaseModel):
+    major_id: Optional[str] = None
+    students: List[RiskFeatures] = [] # (Tùy chọn) cập nhật đặc trưng trước khi chấm
+
 @app.get("/")
 def read_root(): return {"message": "Hệ thống đang chạy (v3.0)!"}
 
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    if not METRICS_ENABLED: raise HTTPException(status_code=404, detail="Metrics đang tắt")
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
 # --- AUTHENTICATION ---
+# bcrypt chạy trong AUTH_EXECUTOR, truy vấn DB trong threadpool (hoặc engine async khi DB_ASYNC=1) -> event loop không bị chặn
 @app.post("/register")
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    if db.query(UserDB).filter(UserDB.username == user.username).first():
+async def register(user: UserCreate, db: Session = Depends(get_db)):
+    exists = await run_in_threadpool(lambda: db.query(UserDB.id).filter(UserDB.username == user.username).first())
+    if exists:
         raise HTTPException(status_code=400, detail="Tài khoản đã tồn tại")
     
     new_user = UserDB(
         username=user.username, 
-        hashed_password=get_password_hash(user.password), 
+        hashed_password=await asyncio.get_running_loop().run_in_executor(AUTH_EXECUTOR, get_password_hash, user.password), 
         full_name=user.full_name, 
         major_id=user.major_id
     )
-    db.add(new_user)
-    db.commit()
+    def save():
+        db.add(new_user)
+        db.commit()
+    await run_in_threadpool(save)
     return {"message": "Đăng ký thành công!"}
 
 @app.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(UserDB).filter(UserDB.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends()):
+    rows = await read_rows(select(UserDB.username, UserDB.hashed_password).where(UserDB.username == form_data.username))
+    user = rows[0] if rows else None
+    if not user or not await asyncio.get_running_loop().run_in_executor(
+            AUTH_EXECUTOR, verify_password, form_data.password, user.hashed_password):
         raise HTTPException(status_code=400, detail="Sai tài khoản hoặc mật khẩu")
     return {"access_token": create_access_token(data={"sub": user.username}), "token_type": "bearer"}
 
 # --- USER & PROGRESS ---
 @app.get("/api/v1/me")
-def get_my_profile(current_user: UserDB = Depends(get_current_user)):
+async def get_my_profile(current_user: UserDB = Depends(get_current_user)):
     return {
         "student_id": current_user.username,
         "full_name": current_user.full_name,
         "gpa": current_user.gpa,
         "progress": (current_user.completed_credits / current_user.total_credits) * 100,
-        "taken_subjects": current_user.taken_subjects
+        "taken_subjects": await load_transcript_async(current_user.username)
     }
 
 # --- CỐ VẤN HỌC TẬP (DYNAMIC) ---
 @app.post("/api/v1/advise/learning-path")
 def advise(req: AdviceRequest, current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
-    transcript = current_user.taken_subjects if current_user.taken_subjects else {}
+    AUDIT.annotate(body=req.model_dump())
+    with METRICS.span("advise.transcript"): transcript = load_transcript(db, current_user.username)
     suggestions = {"retake": [], "standard": [], "advance": [], "message": ""}
 
     # 1. Học lại
     for code, score in transcript.items():
-        if score < 5.0: suggestions["retake"].append({"code": code, "reason": "Trượt môn"})
+        if score < PASS_SCORE: suggestions["retake"].append({"code": code, "reason": "Trượt môn"})
         elif score < 6.5 and req.target_gpa >= 3.2: 
             suggestions["retake"].append({"code": code, "reason": f"Điểm thấp ({score})"})
 
-    # 2. Môn mới (Dựa trên DB)
+    # 2. Môn mới (Dựa trên đồ thị khung chương trình đã cache, không truy vấn DB)
     current_sem = (current_user.completed_credits // 15) + 1
     next_sem = current_sem + 1
+    with METRICS.span("advise.curriculum_graph"): graph = get_curriculum_graph()
+    passed = passed_subjects(transcript)
     
     def get_subjects_for_semester(sem):
-        items = db.query(CurriculumDB).filter(
-            CurriculumDB.major_id == current_user.major_id, CurriculumDB.semester == sem
-        ).all()
-        valid_subjects = []
-        for item in items:
-            # Check đã học chưa
-            if item.subject_id in transcript and transcript[item.subject_id] >= 5.0: continue
-            # Check tiên quyết
-            prereqs = db.query(PrerequisiteDB).filter(PrerequisiteDB.subject_id == item.subject_id).all()
-            passed_prereq = True
-            for p in prereqs:
-                if p.prerequisite_id not in transcript or transcript[p.prerequisite_id] < 5.0:
-                    passed_prereq = False; break
-            if passed_prereq:
-                info = db.query(SubjectDB).filter(SubjectDB.subject_id == item.subject_id).first()
-                valid_subjects.append({"code": item.subject_id, "name": info.subject_name if info else "Môn học"})
-        return valid_subjects
+        with METRICS.span("advise.subjects_for_semester"):
+            return graph.subjects_for_semester(current_user.major_id, sem, passed)
 
     suggestions["standard"] = get_subjects_for_semester(next_sem)
     
@@ -285,29 +900,56 @@ def advise(req: AdviceRequest, current_user: UserDB = Depends(get_current_user),
 
     return {"student": current_user.full_name, "advice": suggestions}
 
+@app.get("/api/v1/advise/degree-plan")
+def degree_plan(max_credits: int = Query(PLAN_CREDIT_CAP, ge=1, le=40),
+                current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+    # Lộ trình ít kỳ nhất đến khi học hết khung chương trình (tôn trọng tiên quyết, <= max_credits TC/kỳ)
+    with METRICS.span("advise.transcript"): passed = passed_subjects(load_transcript(db, current_user.username))
+    with METRICS.span("advise.curriculum_graph"): graph = get_curriculum_graph()
+    with METRICS.span("advise.degree_plan"): plan = graph.plan(current_user.major_id, passed, max_credits)
+    return {"student": current_user.full_name, "major_id": current_user.major_id, "credit_cap": max_credits,
+            **graph.describe_plan(plan, current_user.completed_credits or 0, current_user.total_credits or 0)}
+
+@app.get("/api/v1/advise/cohort-plan")
+def cohort_plan(major_id: str, max_credits: int = Query(PLAN_CREDIT_CAP, ge=1, le=40), detail: bool = False,
+                staff: UserDB = Depends(get_current_staff), db: Session = Depends(get_db)):
+    # Lập kế hoạch cho cả ngành trong 1 lần: 2 truy vấn, mỗi tập môn đã qua khác nhau chỉ giải 1 lần
+    graph = get_curriculum_graph()
+    transcripts = load_all_transcripts(db, major_id)
+    students = db.query(UserDB.username, UserDB.completed_credits, UserDB.total_credits) \
+        .filter(UserDB.major_id == major_id, UserDB.role == "student").all()
+    plans, result = {}, {}
+    for username, completed, total in students:
+        passed = passed_subjects(transcripts.get(username))
+        if passed not in plans: plans[passed] = graph.plan(major_id, passed, max_credits)
+        described = graph.describe_plan(plans[passed], completed or 0, total or 0)
+        if not detail: described.pop("semesters")
+        result[username] = described
+    return {"major_id": major_id, "credit_cap": max_credits, "students": len(result),
+            "distinct_progress": len(plans), "plans": result}
+
 # --- AI CHATBOT & TỰ ĐỘNG HÓA ---
-@app.post("/api/v1/chat")
-async def chat(req: ChatRequest, current_user: UserDB = Depends(get_current_user)):
-    if not gemini_model: return {"reply": "Lỗi kết nối AI"}
-    
+def prepare_chat(req: ChatRequest, current_user: UserDB):
+    # -> (câu trả lời tự động, None, None) hoặc (None, prompt cần gửi cho AI, khóa cache)
     msg = req.message.lower()
     
     # TỰ ĐỘNG HÓA 1: Xin nghỉ học
     if "xin nghỉ" in msg or "nghỉ học" in msg:
-        return {
-            "reply": f"Chào {current_user.full_name}, để xin nghỉ học, bạn hãy tải mẫu đơn tại đây:\n"
-                     "👉 [Link tải Biểu mẫu Xin nghỉ (.docx)]\n"
-                     "Sau đó điền thông tin và gửi lại nội dung cho mình nhé (Ngày nghỉ, Lý do)."
-        }
+        return (f"Chào {current_user.full_name}, để xin nghỉ học, bạn hãy tải mẫu đơn tại đây:\n"
+                "👉 [Link tải Biểu mẫu Xin nghỉ (.docx)]\n"
+                "Sau đó điền thông tin và gửi lại nội dung cho mình nhé (Ngày nghỉ, Lý do)."), None, None
     
     # TỰ ĐỘNG HÓA 2: Nộp đơn (Giả lập)
     if "lý do" in msg and "ngày" in msg:
-        return {"reply": "✅ Đã nhận thông tin! Hệ thống đã tự động gửi email báo cáo cho Giảng viên. Chúc bạn sớm giải quyết xong việc nhé."}
+        return "✅ Đã nhận thông tin! Hệ thống đã tự động gửi email báo cáo cho Giảng viên. Chúc bạn sớm giải quyết xong việc nhé.", None, None
 
     # CHAT THÔNG MINH (RAG)
-    context = f"TÀI LIỆU TRƯỜNG:\n{PDF_CONTENT[:15000]}..." if PDF_CONTENT else ""
+    # Chỉ gửi các đoạn liên quan nhất (BM25) thay vì cắt 15.000 ký tự đầu
+    with METRICS.span("chat.context"): docs = kb.build_context(CORPUS.index, req.message, RAG_TOP_K, RAG_CONTEXT_CHARS)
+    context = f"TÀI LIỆU TRƯỜNG:\n{docs}" if docs else ""
+    # Prompt không chứa thông tin cá nhân -> câu trả lời dùng chung được cho mọi SV hỏi cùng câu
     prompt = f"""
-    Bạn là Trợ lý VHU. Người dùng: {current_user.full_name}.
+    Bạn là Trợ lý VHU. Người dùng: sinh viên VHU.
     {context}
     Yêu cầu:
     1. Trả lời dựa vào tài liệu trên.
@@ -315,5 +957,153 @@ async def chat(req: ChatRequest, current_user: UserDB = Depends(get_current_user
     3. Nếu hỏi về 'Tự động hóa' -> Hướng dẫn họ dùng tính năng xin nghỉ.
     Câu hỏi: {req.message}
     """
-    try: return {"reply": gemini_model.generate_content(prompt).text}
-    except: return {"reply": "Lỗi AI không phản hồi"}
\ No newline at end of file
+    return None, prompt, cache_key(req.message, docs)
+
+async def generate_answer(prompt: str):
+    # Gọi AI trong thread pool riêng -> không chặn event loop của các request khác
+    if METRICS_ENABLED: METRICS.prompt_chars.observe(len(prompt))
+    with METRICS.span("chat.llm"):
+        return await asyncio.get_running_loop().run_in_executor(LLM_EXECUTOR, llm.generate, prompt)
+
+@app.post("/api/v1/chat")
+async def chat(req: ChatRequest, current_user: UserDB = Depends(get_current_user)):
+    AUDIT.annotate(body=req.model_dump())
+    if not llm: return {"reply": "Lỗi kết nối AI"}
+    
+    with METRICS.span("chat.prepare"): auto_reply, prompt, key = prepare_chat(req, current_user)
+    if auto_reply: return {"reply": auto_reply}
+
+    try:
+        with METRICS.span("chat.answer"): # Gồm cả chờ cache / request trùng / hàng đợi AI
+            return {"reply": await ANSWER_CACHE.get_or_compute(key, lambda: generate_answer(prompt))}
+    except Exception: return {"reply": "Lỗi AI không phản hồi"}
+
+def sse_event(data: dict, event: str = None):
+    head = f"event: {event}\n" if event else ""
+    return f"{head}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_llm(prompt: str):
+    # Đọc stream của backend AI trong thread pool, đẩy từng mảnh về event loop qua Queue
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    def worker():
+        try:
+            for part in llm.stream(prompt):
+                loop.call_soon_threadsafe(queue.put_nowait, ("text", part))
+            loop.call_soon_threadsafe(queue.put_nowait, ("done", None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, ("error", str(e)))
+    loop.run_in_executor(LLM_EXECUTOR, worker)
+    while True:
+        kind, value = await queue.get()
+        if kind == "done": return
+        yield kind, value
+        if kind == "error": return
+
+@app.post("/api/v1/chat/stream")
+async def chat_stream(req: ChatRequest, current_user: UserDB = Depends(get_current_user)):
+    # Server-Sent Events: client nhận từng đoạn câu trả lời ngay khi AI sinh ra.
+    # Câu hỏi trùng đang được stream -> không gọi AI lần 2, chờ rồi nhận câu trả lời trọn vẹn trong 1 sự kiện
+    AUDIT.annotate(body=req.model_dump())
+    auto_reply, prompt, key = prepare_chat(req, current_user) if llm else ("Lỗi kết nối AI", None, None)
+
+    async def llm_parts():
+        if METRICS_ENABLED: METRICS.prompt_chars.observe(len(prompt))
+        with METRICS.span("chat.llm_stream"):
+            async for kind, value in stream_llm(prompt):
+                if kind == "error": raise RuntimeError(value)
+                yield value
+
+    async def events():
+        if auto_reply:
+            yield sse_event({"text": auto_reply})
+        else:
+            try:
+                async for part in ANSWER_CACHE.stream_or_compute(key, llm_parts):
+                    yield sse_event({"text": part})
+            except Exception: yield sse_event({"text": "Lỗi AI không phản hồi"}, "error")
+        yield sse_event({}, "done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# --- NẠP SINH VIÊN HÀNG LOẠT ---
+@app.post("/api/v1/students/bulk")
+def bulk_import_students(file: UploadFile = File(...), staff: UserDB = Depends(get_current_staff), db: Session = Depends(get_db)):
+    start = time.perf_counter()
+    try: report = import_students(db, iter_student_rows(file.file, file.filename or ""))
+    except ValueError as e: raise HTTPException(status_code=400, detail=str(e))
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    return report
+
+# --- DỰ BÁO RỦI RO HỌC TẬP (CHẤM THEO LÔ, ĐỌC KẾT QUẢ CHẤM SẴN) ---
+@app.post("/api/v1/risk/batch")
+def risk_batch(req: RiskBatchRequest, staff: UserDB = Depends(get_current_staff), db: Session = Depends(get_db)):
+    if MODELS.get("risk_predictor") is None: raise HTTPException(status_code=503, detail="Chưa có model dự báo rủi ro")
+    usernames = None
+    if req.students:
+        usernames = [s.username for s in req.students]
+        replace_rows(db, RiskFeatureDB, [s.model_dump() for s in req.students])
+        db.commit()
+    return score_risk_cohort(db, req.major_id, usernames)
+
+@app.get("/api/v1/risk")
+def list_risk(major_id: Optional[str] = None, min_risk: float = 0.0, limit: int = Query(1000, le=20000),
+              staff: UserDB = Depends(get_current_staff), db: Session = Depends(get_db)):
+    query = db.query(RiskScoreDB).filter(RiskScoreDB.risk >= min_risk)
+    if major_id: query = query.filter(RiskScoreDB.major_id == major_id)
+    rows = query.order_by(RiskScoreDB.risk.desc()).limit(limit).all()
+    return [{"student_id": r.username, "major_id": r.major_id, "risk": r.risk,
+             "model_version": r.model_version, "scored_at": r.scored_at} for r in rows]
+
+@app.get("/api/v1/me/risk")
+def my_risk(current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+    row = db.query(RiskScoreDB).filter(RiskScoreDB.username == current_user.username).first()
+    if row is None: raise HTTPException(status_code=404, detail="Chưa có kết quả dự báo rủi ro")
+    return {"risk": row.risk, "model_version": row.model_version, "scored_at": row.scored_at}
+
+# --- THỐNG KÊ ĐIỂM THEO MÔN (TRUY VẤN CÓ CHỈ MỤC TRÊN BẢNG GRADES) ---
+@app.get("/api/v1/subjects/{subject_id}/failed")
+def failed_students(subject_id: str, staff: UserDB = Depends(get_current_staff), db: Session = Depends(get_db)):
+    # SV chưa qua môn: trượt và chưa có lần học lại nào đạt
+    passed = select(GradeDB.username).where(GradeDB.subject_id == subject_id, GradeDB.score >= PASS_SCORE)
+    rows = db.query(GradeDB.username, func.max(GradeDB.score)) \
+        .filter(GradeDB.subject_id == subject_id, GradeDB.score < PASS_SCORE, GradeDB.username.not_in(passed)) \
+        .group_by(GradeDB.username).all()
+    return [{"student_id": u, "best_score": score} for u, score in rows]
+
+@app.get("/api/v1/subjects/{subject_id}/retakes")
+def retake_list(subject_id: str, below: float = 6.5, staff: UserDB = Depends(get_current_staff), db: Session = Depends(get_db)):
+    # Danh sách nên học lại / cải thiện: điểm cao nhất của môn vẫn < ngưỡng
+    rows = db.query(GradeDB.username, func.max(GradeDB.score).label("best")) \
+        .filter(GradeDB.subject_id == subject_id).group_by(GradeDB.username) \
+        .having(func.max(GradeDB.score) < below).all()
+    return [{"student_id": u, "best_score": score} for u, score in rows]
+
+# --- GỢI Ý MÔN HỌC (ĐỌC BẢNG TOP-N TÍNH SẴN) ---
+@app.get("/api/v1/recommend")
+def recommend(current_user: UserDB = Depends(get_current_user), db: Session = Depends(get_db)):
+    entry = MODELS.get("course_recommender")
+    if entry is None: raise HTTPException(status_code=503, detail="Chưa có model gợi ý môn học")
+    transcript = load_transcript(db, current_user.username)
+    passed = passed_subjects(transcript)
+    row = RECOMMENDATIONS.get(current_user.username)
+    if row is None or row[0] != passed:
+        # SV mới hoặc bảng điểm vừa thay đổi -> tính lại riêng dòng của SV này
+        row = compute_recommendations([(current_user.username, transcript)], entry)[current_user.username]
+        RECOMMENDATIONS[current_user.username] = row
+    return {"student_id": current_user.username, "recommendations": row[1], "model_version": entry.version}
+
+@app.post("/api/v1/recommend/refresh")
+def recommend_refresh(staff: UserDB = Depends(get_current_staff)):
+    return {"students": refresh_recommendations()}
+
+# --- QUẢN TRỊ MODEL (ĐỔI NÓNG SAU KHI HUẤN LUYỆN LẠI) ---
+@app.get("/api/v1/admin/models")
+def list_models(staff: UserDB = Depends(get_current_staff)):
+    return {name: {"version": e.version, "path": e.path, "loaded_at": e.loaded_at} for name, e in MODELS.loaded().items()}
+
+@app.post("/api/v1/admin/models/reload")
+def reload_models(name: Optional[str] = None, staff: UserDB = Depends(get_current_staff)):
+    if staff.role != "admin": raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Không có quyền truy cập")
+    entries = {name: MODELS.reload(name)} if name else MODELS.reload_all()
+    return {n: (e.version if e else None) for n, e in entries.items()}
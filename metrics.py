@@ -0,0 +1,127 @@
+# =============================================================================
+# ĐO THỜI GIAN TỪNG CHẶNG + XUẤT METRICS DẠNG PROMETHEUS TEXT (/metrics)
+# =============================================================================
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra: parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames, self.buckets = name, help_text, tuple(labelnames), tuple(buckets)
+        self._series = {} # nhãn -> [đếm theo bucket..., tổng, số lần]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None: series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound: series[i] += 1; break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock: snapshot = {k: list(v) for k, v in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+class Gauge:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name, self.help, self.labelnames = name, help_text, tuple(labelnames)
+        self._values = {}
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(dict(self._values).items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Metrics:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.request_seconds = Histogram("vhu_http_request_duration_seconds", "Thời gian xử lý request theo route", ("method", "route", "status"))
+        self.stage_seconds = Histogram("vhu_stage_duration_seconds", "Thời gian từng chặng xử lý", ("stage",))
+        self.db_queries = Histogram("vhu_db_queries_per_request", "Số truy vấn DB mỗi request", ("route",), COUNT_BUCKETS)
+        self.prompt_chars = Histogram("vhu_llm_prompt_chars", "Độ dài prompt gửi cho AI (ký tự)", (), SIZE_BUCKETS)
+        self.startup_seconds = Gauge("vhu_startup_phase_seconds", "Thời gian từng giai đoạn khởi động", ("phase",))
+        self._collectors = [] # Hàm trả về các dòng metrics bổ sung (vd. thống kê cache)
+        self._request = contextvars.ContextVar("vhu_request_stats", default=None)
+
+    @contextmanager
+    def _span(self, stage):
+        start = time.perf_counter()
+        try: yield
+        finally: self.stage_seconds.observe(time.perf_counter() - start, stage)
+
+    def span(self, stage):
+        # Tắt metrics -> nullcontext, gần như không tốn chi phí
+        return self._span(stage) if self.enabled else nullcontext()
+
+    @contextmanager
+    def startup_phase(self, phase):
+        start = time.perf_counter()
+        try: yield
+        finally: self.startup_seconds.set(round(time.perf_counter() - start, 4), phase)
+
+    def count_db_query(self, *args):
+        stats = self._request.get()
+        if stats is not None: stats["db_queries"] += 1
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in (self.request_seconds, self.stage_seconds, self.db_queries, self.prompt_chars, self.startup_seconds):
+            lines += metric.render()
+        for collector in self._collectors: lines += collector()
+        return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    # ASGI middleware thuần (không bọc Response) -> chi phí thấp, không phá SSE streaming
+    def __init__(self, app, metrics):
+        self.app, self.metrics = app, metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            return await self.app(scope, receive, send)
+        stats = {"db_queries": 0, "status": 500}
+        token = self.metrics._request.set(stats)
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start": stats["status"] = message["status"]
+            await send(message)
+        start = time.perf_counter()
+        try: await self.app(scope, receive, send_wrapper)
+        finally:
+            self.metrics._request.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", "unmatched")
+            self.metrics.request_seconds.observe(time.perf_counter() - start, scope["method"], path, str(stats["status"]))
+            self.metrics.db_queries.observe(stats["db_queries"], path)
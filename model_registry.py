@@ -0,0 +1,113 @@
+# =============================================================================
+# KHO MODEL (REGISTRY): NẠP LƯỜI, CÓ PHIÊN BẢN, ĐỔI MODEL NÓNG KHÔNG CẦN RESTART
+# =============================================================================
+
+import glob
+import hashlib
+import os
+import threading
+import time
+
+import joblib
+
+class ModelEntry:
+    # 1 phiên bản model đã nạp. Không sửa sau khi tạo -> request đang chạy giữ
+    # tham chiếu tới entry cũ vẫn chạy xong an toàn khi model được đổi.
+    def __init__(self, name, version, path, model, prepared, load_seconds):
+        self.name = name
+        self.version = version
+        self.path = path
+        self.model = model
+        self.prepared = prepared # Dữ liệu dẫn xuất (vd. ma trận SVD), tính trước khi đổi
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+
+def file_version(path):
+    # Phiên bản model = tên file + 10 ký tự đầu SHA1 nội dung
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""): h.update(block)
+    return f"{os.path.basename(path)}@{h.hexdigest()[:10]}"
+
+def reserve_version_path(folder):
+    # Đường dẫn models/<name>/<thời điểm>-NNN.pkl cho bản huấn luyện mới (script train_*.py).
+    # Giữ chỗ bằng file .json tạo độc quyền (O_EXCL) -> 2 lần chạy song song / cùng 1 giây không lấy trùng tên
+    os.makedirs(folder, exist_ok=True)
+    version, n = time.strftime("%Y%m%d-%H%M%S"), 0
+    while True:
+        path = os.path.join(folder, f"{version}-{n:03d}.pkl")
+        try:
+            if not os.path.exists(path):
+                os.close(os.open(os.path.splitext(path)[0] + ".json", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return path
+        except FileExistsError: pass
+        n += 1
+
+class ModelRegistry:
+    def __init__(self, model_dir="models", mmap_mode="r"):
+        self.model_dir = model_dir
+        self.mmap_mode = mmap_mode # joblib mmap: các worker dùng chung mảng numpy qua page cache
+        self._specs = {}   # name -> (file gốc, prepare, [hook sau khi đổi])
+        self._entries = {} # name -> ModelEntry đang phục vụ
+        self._lock = threading.Lock()
+
+    def register(self, name, legacy_path, prepare=None):
+        self._specs[name] = (legacy_path, prepare, [])
+
+    def on_swap(self, name, hook):
+        self._specs[name][2].append(hook)
+
+    def resolve(self, name):
+        # Ưu tiên bản mới nhất trong models/<name>/<phiên bản>.pkl, sau đó tới file gốc <name>.pkl
+        versions = sorted(glob.glob(os.path.join(self.model_dir, name, "*.pkl")))
+        if versions: return versions[-1], os.path.splitext(os.path.basename(versions[-1]))[0]
+        legacy_path = self._specs[name][0]
+        if os.path.exists(legacy_path): return legacy_path, file_version(legacy_path)
+        return None, None
+
+    def get(self, name):
+        # Đường nóng: chỉ 1 lần tra dict; nạp lười ở lần gọi đầu tiên
+        entry = self._entries.get(name)
+        if entry is not None: return entry
+        with self._lock:
+            if name not in self._entries: self._entries[name] = self._load(name)
+            return self._entries[name]
+
+    def reload(self, name):
+        # Nạp bản mới ngoài lock rồi đổi tham chiếu 1 lần (nguyên tử).
+        # Nạp lỗi -> giữ nguyên model đang phục vụ.
+        entry = self._load(name)
+        if entry is None: return self._entries.get(name)
+        with self._lock: old, self._entries[name] = self._entries.get(name), entry
+        if old is None or old.version != entry.version:
+            for hook in self._specs[name][2]: hook(entry)
+        return entry
+
+    def reload_all(self):
+        return {name: self.reload(name) for name in self._specs}
+
+    def loaded(self):
+        return {name: e for name, e in self._entries.items() if e is not None}
+
+    def watched_paths(self):
+        return [os.path.abspath(self.model_dir)] + [os.path.abspath(p) for p, _, _ in self._specs.values()]
+
+    def name_for_path(self, path):
+        path = os.path.abspath(path)
+        for name, (legacy_path, _, _) in self._specs.items():
+            if path == os.path.abspath(legacy_path) or path.startswith(os.path.abspath(os.path.join(self.model_dir, name)) + os.sep):
+                return name
+        return None
+
+    def _load(self, name):
+        path, version = self.resolve(name)
+        if path is None: return None
+        start = time.perf_counter()
+        try: model = joblib.load(path, mmap_mode=self.mmap_mode)
+        except Exception as e:
+            print(f"   ❌ [Lỗi] Không nạp được model {name} ({path}): {e}")
+            return None
+        prepare = self._specs[name][1]
+        prepared = prepare(model) if prepare else None
+        print(f"   🧠 [Model] {name} phiên bản {version} ({time.perf_counter() - start:.2f}s)")
+        return ModelEntry(name, version, path, model, prepared, time.perf_counter() - start)
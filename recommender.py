@@ -0,0 +1,133 @@
+# =============================================================================
+# GỢI Ý MÔN HỌC: CHẤM ĐIỂM TOÀN BỘ SINH VIÊN x MÔN HỌC TỪ MA TRẬN SVD
+# =============================================================================
+
+import numpy as np
+
+def svd_factors(model):
+    # Lấy các mảng đã huấn luyện từ model SVD (thư viện surprise).
+    # Bản do train_recommender.py ghi (models/course_recommender/*.pkl) đã là dict nhân tố sẵn.
+    if isinstance(model, dict): return model
+    ts = model.trainset
+    return {
+        "mu": float(ts.global_mean),
+        "pu": np.asarray(model.pu), "qi": np.asarray(model.qi),
+        "bu": np.asarray(model.bu), "bi": np.asarray(model.bi),
+        "users": dict(ts._raw2inner_id_users), # mã SV -> hàng trong pu
+        "items": dict(ts._raw2inner_id_items), # mã môn -> hàng trong qi
+        "scale": ts.rating_scale,
+    }
+
+def predict_matrix(factors, usernames):
+    # Điểm dự đoán cho mọi (sinh viên, môn) bằng 1 phép nhân ma trận.
+    # SV chưa có trong tập huấn luyện: giống surprise -> bu = 0, pu = 0.
+    rows = np.array([factors["users"].get(u, -1) for u in usernames], dtype=np.int64)
+    known = rows >= 0
+    n_factors = factors["qi"].shape[1]
+    pu = np.zeros((len(usernames), n_factors))
+    bu = np.zeros(len(usernames))
+    pu[known] = factors["pu"][rows[known]]
+    bu[known] = factors["bu"][rows[known]]
+    scores = factors["mu"] + bu[:, None] + factors["bi"][None, :] + pu @ factors["qi"].T
+    low, high = factors["scale"]
+    return np.clip(scores, low, high)
+
+def top_n(factors, usernames, passed_sets, prereqs, n=5):
+    # -> {mã SV: [(mã môn, điểm dự đoán)]}, bỏ môn đã qua và môn chưa đủ tiên quyết
+    if not usernames: return {}
+    item_ids = sorted(factors["items"], key=factors["items"].get) # theo thứ tự cột trong qi
+    scores = predict_matrix(factors, usernames)
+
+    # Không gian môn học chung cho ma trận "đã qua" và ma trận "tiên quyết"
+    universe = {code: i for i, code in enumerate(sorted(set(item_ids).union(*prereqs.values())))}
+    passed = np.zeros((len(usernames), len(universe)), dtype=np.int32)
+    for r, subjects in enumerate(passed_sets):
+        cols = [universe[c] for c in subjects if c in universe]
+        passed[r, cols] = 1
+    required = np.zeros((len(item_ids), len(universe)), dtype=np.int32)
+    for c, code in enumerate(item_ids):
+        cols = [universe[p] for p in prereqs.get(code, ())]
+        required[c, cols] = 1
+
+    item_cols = [universe[code] for code in item_ids]
+    unmet = (1 - passed) @ required.T  # số môn tiên quyết chưa qua
+    mask = (passed[:, item_cols] == 1) | (unmet > 0)
+    scores = np.where(mask, -np.inf, scores)
+
+    k = min(n, len(item_ids))
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    result = {}
+    for r, username in enumerate(usernames):
+        order = best[r][np.argsort(-scores[r, best[r]])]
+        result[username] = [(item_ids[c], float(scores[r, c])) for c in order if np.isfinite(scores[r, c])]
+    return result
+
+# =============================================================================
+# HUẤN LUYỆN LẠI TĂNG DẦN (ALS CÓ BIAS): KHỞI ĐỘNG ẤM TỪ NHÂN TỐ CŨ, GHÉP THÊM SV/MÔN MỚI
+# =============================================================================
+# Cùng mô hình với SVD của surprise: điểm = mu + bu + bi + pu·qi. Giải bằng ALS (bình phương tối thiểu
+# luân phiên) vì mỗi bước chỉ là các bài ridge độc lập theo từng SV/môn -> cập nhật được riêng phần thay đổi.
+
+def new_factors(users, items, n_factors, scale, mu, previous=None, seed=0):
+    # Ma trận nhân tố cho danh sách SV/môn; hàng đã có trong `previous` được chép sang (warm start)
+    rng = np.random.RandomState(seed)
+    factors = {
+        "mu": mu, "scale": tuple(scale),
+        "pu": rng.normal(0, 0.1, (len(users), n_factors)), "qi": rng.normal(0, 0.1, (len(items), n_factors)),
+        "bu": np.zeros(len(users)), "bi": np.zeros(len(items)),
+        "users": {u: r for r, u in enumerate(users)}, "items": {c: r for r, c in enumerate(items)},
+    }
+    if previous is not None:
+        for side, bias, key in (("pu", "bu", "users"), ("qi", "bi", "items")):
+            pairs = [(row, previous[key][name]) for name, row in factors[key].items() if name in previous[key]]
+            if not pairs: continue
+            new_rows, old_rows = map(np.array, zip(*pairs))
+            factors[side][new_rows] = previous[side][old_rows]
+            factors[bias][new_rows] = previous[bias][old_rows]
+    return factors
+
+def extend_factors(factors, users, items, seed=0):
+    # Thêm hàng cho SV/môn mới (giữ nguyên hàng cũ) -> bản sao ghi được, không đụng bản đang phục vụ
+    users = list(factors["users"]) + [u for u in users if u not in factors["users"]]
+    items = list(factors["items"]) + [c for c in items if c not in factors["items"]]
+    return new_factors(users, items, factors["qi"].shape[1], factors["scale"], factors["mu"], factors, seed)
+
+def als_step(rows, cols, targets, fixed, reg, out_factors, out_bias):
+    # Với phía kia cố định, mỗi hàng (SV hoặc môn) có mặt trong `rows` là 1 bài ridge (k+1 ẩn, gồm bias).
+    # Hàng không có dữ liệu giữ nguyên -> chi phí tỉ lệ với phần dữ liệu đưa vào.
+    k = fixed.shape[1]
+    order = np.argsort(rows, kind="stable")
+    rows, cols, targets = rows[order], cols[order], targets[order]
+    ids, starts = np.unique(rows, return_index=True)
+    ends = np.append(starts[1:], len(rows))
+    penalty = reg * np.eye(k + 1)
+    for row, s, e in zip(ids, starts, ends):
+        x = np.hstack([fixed[cols[s:e]], np.ones((e - s, 1))])
+        w = np.linalg.solve(x.T @ x + penalty, x.T @ targets[s:e])
+        out_factors[row], out_bias[row] = w[:k], w[k]
+
+def fit_als(factors, u, i, r, epochs=10, reg=0.1, update_items=True):
+    # u, i: chỉ số hàng trong factors; r: điểm. update_items=False -> chỉ ghép SV (fold-in)
+    mu, pu, qi, bu, bi = factors["mu"], factors["pu"], factors["qi"], factors["bu"], factors["bi"]
+    for _ in range(epochs):
+        als_step(u, i, r - mu - bi[i], qi, reg, pu, bu)
+        if update_items: als_step(i, u, r - mu - bu[u], pu, reg, qi, bi)
+    return factors
+
+def predict_pairs(factors, usernames, subjects):
+    # Điểm dự đoán cho từng cặp (SV, môn); SV/môn chưa biết -> phần tương ứng = 0 (như surprise)
+    u = np.array([factors["users"].get(x, -1) for x in usernames], dtype=np.int64)
+    i = np.array([factors["items"].get(x, -1) for x in subjects], dtype=np.int64)
+    ku, ki = u >= 0, i >= 0
+    pred = np.full(len(u), factors["mu"], dtype=np.float64)
+    pred[ku] += factors["bu"][u[ku]]
+    pred[ki] += factors["bi"][i[ki]]
+    both = ku & ki
+    pred[both] += np.einsum("ij,ij->i", factors["pu"][u[both]], factors["qi"][i[both]])
+    return np.clip(pred, *factors["scale"])
+
+def accuracy(factors, usernames, subjects, ratings):
+    # -> {"rmse", "mae", "n"} trên các cặp cho trước
+    if not len(ratings): return {"rmse": None, "mae": None, "n": 0}
+    err = predict_pairs(factors, usernames, subjects) - np.asarray(ratings, dtype=np.float64)
+    return {"rmse": round(float(np.sqrt(np.mean(err ** 2))), 4), "mae": round(float(np.mean(np.abs(err))), 4), "n": len(err)}
@@ -0,0 +1,27 @@
+# SCRIPT CHẤM ĐIỂM RỦI RO THEO LÔ (OFFLINE) - ghi kết quả vào bảng risk_scores
+# Cách dùng: python score_risk.py [--major CNTT] [--features risk_features.csv]
+import argparse
+import time
+import pandas as pd
+from main import SessionLocal, RiskFeatureDB, RISK_FEATURES, replace_rows, score_risk_cohort
+
+parser = argparse.ArgumentParser(description="Chấm điểm rủi ro học tập cho cả khóa/ngành")
+parser.add_argument("--major", help="Chỉ chấm 1 ngành (major_id)")
+parser.add_argument("--features", help="File CSV đặc trưng: username + " + ", ".join(RISK_FEATURES))
+args = parser.parse_args()
+
+db = SessionLocal()
+
+# 1. (Tùy chọn) Nạp đặc trưng từ CSV vào bảng risk_features
+if args.features:
+    df = pd.read_csv(args.features, dtype={"username": str})
+    rows = df[["username"] + RISK_FEATURES].to_dict("records")
+    replace_rows(db, RiskFeatureDB, rows)
+    db.commit()
+    print(f"Đã nạp đặc trưng cho {len(rows)} sinh viên")
+
+# 2. Chấm điểm cả lô
+start = time.perf_counter()
+result = score_risk_cohort(db, args.major)
+print(f"✅ Đã chấm {result['scored']} sinh viên (model {result['model_version']}) trong {time.perf_counter() - start:.2f}s")
+db.close()
@@ -1,74 +1,76 @@
-import pandas as pd
-import requests
-import json
+import argparse
+import csv
+import os
 import time
+import requests
 
 # CẤU HÌNH
 EXCEL_FILE = "sinhvien_data.xlsx"
-API_URL = "http://127.0.0.1:8000/api/v1/students"
-
-def import_data():
-    print(f"🔄 Đang đọc file Excel: {EXCEL_FILE}...")
-    
-    try:
-        # Đọc file Excel bằng Pandas
-        df = pd.read_excel(EXCEL_FILE)
-        
-        # Kiểm tra xem file có dữ liệu không
-        if df.empty:
-            print("⚠️ File Excel rỗng!")
-            return
+API_URL = "http://127.0.0.1:8000/api/v1/students/bulk"
 
-        print(f"✅ Đã tìm thấy {len(df)} sinh viên. Bắt đầu nạp vào hệ thống...")
-        print("-" * 50)
+# Cách dùng:
+#   python tool_import_excel.py [file.xlsx|file.csv]                      -> nạp thẳng vào Database
+#   python tool_import_excel.py [file] --api --token <JWT cán bộ>         -> gửi cả file lên server 1 lần
+#   python tool_import_excel.py [file] --passwords-out matkhau.csv        -> ghi mật khẩu cấp mới ra file thay vì in ra
 
-        success_count = 0
-        error_count = 0
+def print_report(report, passwords_out=None):
+    for err in report["errors"]:
+        print(f"🔴 [ERROR] Dòng {err['row']} ({err['student_id']}): {err['error']}")
+    print("-" * 50)
+    print(f"🎉 HOÀN TẤT! Thêm mới: {report['created']} | Cập nhật: {report['updated']} | Lỗi: {len(report['errors'])}")
+    # SV mới không có cột matkhau nhận mật khẩu ngẫu nhiên: chỉ có trong báo cáo này -> phải giao lại cho SV
+    passwords = report.get("passwords") or []
+    if not passwords: return
+    print(f"⚠️ {len(passwords)} SV mới được cấp mật khẩu ngẫu nhiên (không lưu ở đâu khác, hãy gửi cho SV).")
+    if passwords_out:
+        fd = os.open(passwords_out, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) # Chỉ chủ file đọc được
+        with open(fd, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["masv", "matkhau"])
+            writer.writerows((p["student_id"], p["password"]) for p in passwords)
+        print(f"🔑 Đã ghi mật khẩu vào: {passwords_out}")
+    else:
+        for p in passwords: print(f"🔑 {p['student_id']}: {p['password']}")
 
-        # Duyệt qua từng dòng trong Excel
-        for index, row in df.iterrows():
-            # Xử lý cột 'mon_da_hoc': Chuyển chuỗi "CS101, MA101" thành list ["CS101", "MA101"]
-            mon_hoc_str = str(row['mon_da_hoc'])
-            if pd.isna(row['mon_da_hoc']) or mon_hoc_str.lower() == 'nan':
-                taken_subjects = []
-            else:
-                taken_subjects = [m.strip() for m in mon_hoc_str.split(',')]
-
-            # Tạo payload đúng chuẩn API quy định
-            student_payload = {
-                "student_id": str(row['masv']),
-                "full_name": str(row['hoten']),
-                "major": str(row['nganh']),
-                "total_credits": 150, # Mặc định hoặc lấy từ Excel nếu có cột này
-                "completed_credits": int(row['tinchi_tichluy']),
-                "gpa": float(row['gpa']),
-                "taken_subjects": taken_subjects
-            }
-
-            try:
-                # Gửi request POST đến API (Giống như nhập tay trên Docs)
-                response = requests.post(API_URL, json=student_payload)
+def import_local(path):
+    # Đọc từng dòng (openpyxl read-only), ghi theo lô trong 1 transaction, băm mật khẩu song song
+    from main import SessionLocal, import_students, iter_student_rows
+    db = SessionLocal()
+    try:
+        with open(path, "rb") as f: return import_students(db, iter_student_rows(f, path))
+    finally: db.close()
 
-                if response.status_code == 200:
-                    print(f"🟢 [OK] Đã nạp: {row['hoten']} ({row['masv']})")
-                    success_count += 1
-                elif response.status_code == 400:
-                    print(f"🟡 [SKIP] Sinh viên {row['masv']} đã tồn tại.")
-                else:
-                    print(f"🔴 [ERROR] Lỗi khi nạp {row['masv']}: {response.text}")
-                    error_count += 1
-            
-            except requests.exceptions.ConnectionError:
-                print("❌ LỖI: Không kết nối được Server! Hãy chắc chắn bạn đã chạy 'uvicorn main:app'.")
-                return
+def import_via_api(path, token, api_url):
+    with open(path, "rb") as f:
+        response = requests.post(api_url, files={"file": (path, f)}, headers={"Authorization": f"Bearer {token}"})
+    if response.status_code != 200:
+        raise RuntimeError(f"Server trả về {response.status_code}: {response.text}")
+    return response.json()
 
-        print("-" * 50)
-        print(f"🎉 HOÀN TẤT! Thành công: {success_count} | Lỗi: {error_count}")
+def import_data():
+    parser = argparse.ArgumentParser(description="Nạp danh sách sinh viên từ Excel/CSV")
+    parser.add_argument("file", nargs="?", default=EXCEL_FILE)
+    parser.add_argument("--api", action="store_true", help="Gửi file lên server thay vì ghi thẳng vào DB")
+    parser.add_argument("--api-url", default=API_URL)
+    parser.add_argument("--token", help="JWT của tài khoản cán bộ (admin/advisor)")
+    parser.add_argument("--passwords-out", help="File CSV (masv, matkhau) ghi mật khẩu cấp cho SV mới; bỏ trống = in ra màn hình")
+    args = parser.parse_args()
 
+    print(f"🔄 Đang nạp file: {args.file}...")
+    start = time.perf_counter()
+    try:
+        report = import_via_api(args.file, args.token, args.api_url) if args.api else import_local(args.file)
     except FileNotFoundError:
-        print(f"❌ LỖI: Không tìm thấy file '{EXCEL_FILE}'. Hãy tạo file Excel trước.")
+        print(f"❌ LỖI: Không tìm thấy file '{args.file}'. Hãy tạo file Excel trước.")
+        return
+    except requests.exceptions.ConnectionError:
+        print("❌ LỖI: Không kết nối được Server! Hãy chắc chắn bạn đã chạy 'uvicorn main:app'.")
+        return
     except Exception as e:
-        print(f"❌ LỖI KHÔNG XÁC ĐỊNH: {e}")
+        print(f"❌ LỖI: {e}")
+        return
+    print_report(report, args.passwords_out)
+    print(f"⏱️ Thời gian: {time.perf_counter() - start:.2f}s")
 
 if __name__ == "__main__":
-    import_data()
\ No newline at end of file
+    import_data()
@@ -1,28 +1,177 @@
-import pandas as pd
-from surprise import SVD, Dataset, Reader
-import joblib # Thư viện để lưu/tải mô hình
+# PIPELINE HUẤN LUYỆN LẠI MODEL GỢI Ý MÔN HỌC, LẤY ĐIỂM TRỰC TIẾP TỪ DB
+# Đọc bảng grades theo từng khúc (không nạp cả bảng vào RAM), ghi bản mới vào
+# models/course_recommender/<phiên bản>.pkl kèm file .json thống kê (thời gian, RMSE/MAE...).
+# Server (ModelRegistry) tự lấy bản mới nhất khi /admin/models/reload hoặc MODEL_WATCH=1.
+#
+# Cách dùng:
+#   python train_recommender.py            -> tăng dần: chỉ đọc điểm mới (id > watermark của bản trước),
+#                                             giải lại SV bị ảnh hưởng + ghép môn mới, nhân tố còn lại giữ nguyên
+#   python train_recommender.py --full     -> huấn luyện lại toàn bộ, khởi động ấm từ nhân tố của bản trước
+# Điểm bị sửa tại chỗ (UPDATE, không đổi id) không lọt vào phần tăng dần -> chạy --full định kỳ.
+import argparse
+import glob
+import json
+import os
+import time
 
-print("Bắt đầu huấn luyện mô hình gợi ý...")
+import joblib
+import numpy as np
+from sqlalchemy import bindparam, create_engine, text
 
-# 1. Đọc dữ liệu từ file CSV
-df = pd.read_csv('ratings.csv')
+import recommender as rec
+from model_registry import reserve_version_path
 
-# 2. Chuẩn bị dữ liệu cho thư viện surprise
-# Thang điểm của chúng ta là từ 0-10
-reader = Reader(rating_scale=(0, 10))
-data = Dataset.load_from_df(df[['student_id', 'subject_id', 'grade']], reader)
+parser = argparse.ArgumentParser(description="Huấn luyện (lại) model gợi ý môn học từ bảng grades")
+parser.add_argument("--full", action="store_true", help="Huấn luyện lại toàn bộ thay vì chỉ phần điểm mới")
+parser.add_argument("--database-url", default=os.getenv("DATABASE_URL", "sqlite:///./vhu_secure.db"))
+parser.add_argument("--model-dir", default=os.getenv("MODEL_DIR", "models"))
+parser.add_argument("--chunk-size", type=int, default=10000, help="Số dòng điểm mỗi lần đọc từ DB")
+parser.add_argument("--factors", type=int, default=20, help="Số nhân tố ẩn (khi không có bản trước)")
+parser.add_argument("--epochs", type=int, default=15, help="Số vòng ALS khi huấn luyện từ đầu")
+parser.add_argument("--warm-epochs", type=int, default=5, help="Số vòng ALS khi khởi động ấm từ bản trước")
+parser.add_argument("--reg", type=float, default=0.1, help="Hệ số điều chuẩn (ridge)")
+parser.add_argument("--holdout", type=float, default=0.1, help="Tỉ lệ điểm giữ lại để đo RMSE khi --full")
+parser.add_argument("--seed", type=int, default=42)
+args = parser.parse_args()
 
-# 3. Sử dụng toàn bộ dữ liệu để huấn luyện (vì đây là demo)
-trainset = data.build_full_trainset()
+NAME = "course_recommender"
+LEGACY_PATH = "course_recommender.pkl"
+SCALE = (0, 10) # Thang điểm 0-10
+USER_BATCH = 500 # Số SV mỗi câu IN (...) khi đọc lại lịch sử điểm
 
-# 4. Chọn thuật toán SVD (một thuật toán gợi ý phổ biến)
-model = SVD()
+def latest_artifact():
+    # -> (đường dẫn, nhân tố) của bản mới nhất; chưa có bản nào -> thử file gốc do surprise huấn luyện
+    versions = sorted(glob.glob(os.path.join(args.model_dir, NAME, "*.pkl")))
+    if versions: return versions[-1], joblib.load(versions[-1])
+    if os.path.exists(LEGACY_PATH):
+        try: return LEGACY_PATH, rec.svd_factors(joblib.load(LEGACY_PATH))
+        except Exception as e: print(f"⚠️ Bỏ qua {LEGACY_PATH}: {e}")
+    return None, None
 
-# 5. Dạy (train) mô hình
-model.fit(trainset)
+def stream_grades(conn, after_id):
+    # Điểm cao nhất mỗi (SV, môn) trong các dòng có id > after_id, đọc từng khúc chunk_size dòng
+    # -> ({(SV, môn): điểm}, id lớn nhất, số dòng đã đọc)
+    ratings, watermark, rows = {}, after_id, 0
+    result = conn.execution_options(stream_results=True, yield_per=args.chunk_size).execute(
+        text("SELECT id, username, subject_id, score FROM grades WHERE id > :after AND score IS NOT NULL ORDER BY id"),
+        {"after": after_id})
+    for chunk in result.partitions():
+        for grade_id, username, subject_id, score in chunk:
+            key = (username, subject_id)
+            if score > ratings.get(key, -1): ratings[key] = float(score)
+        watermark, rows = chunk[-1][0], rows + len(chunk)
+    return ratings, watermark, rows
 
-# 6. Lưu mô hình đã huấn luyện ra 1 file
-# File "course_recommender.pkl" này chính là "bộ não" AI đã học
-joblib.dump(model, 'course_recommender.pkl')
+def load_user_ratings(conn, usernames):
+    # Toàn bộ lịch sử điểm (điểm cao nhất mỗi môn) của các SV cho trước, theo từng lô USER_BATCH SV
+    query = text("SELECT username, subject_id, MAX(score) FROM grades WHERE username IN :names "
+                 "AND score IS NOT NULL GROUP BY username, subject_id").bindparams(bindparam("names", expanding=True))
+    usernames, ratings = sorted(usernames), {}
+    for i in range(0, len(usernames), USER_BATCH):
+        for username, subject_id, score in conn.execute(query, {"names": usernames[i:i + USER_BATCH]}):
+            ratings[(username, subject_id)] = float(score)
+    return ratings
 
-print("Đã huấn luyện và lưu mô hình thành công!")
\ No newline at end of file
+def to_arrays(factors, ratings):
+    keys = list(ratings)
+    u = np.array([factors["users"][k[0]] for k in keys], dtype=np.int64)
+    i = np.array([factors["items"][k[1]] for k in keys], dtype=np.int64)
+    return u, i, np.array([ratings[k] for k in keys], dtype=np.float64)
+
+def split_accuracy(factors, ratings):
+    keys = list(ratings)
+    return rec.accuracy(factors, [k[0] for k in keys], [k[1] for k in keys], [ratings[k] for k in keys])
+
+def train_full(ratings, previous):
+    # Giữ lại 1 phần điểm để đo RMSE, huấn luyện trên phần còn lại rồi thêm vài vòng trên toàn bộ dữ liệu
+    keys = list(ratings)
+    rng = np.random.RandomState(args.seed)
+    n_hold = int(len(keys) * args.holdout) if len(keys) >= 10 else 0
+    held = {keys[j] for j in rng.permutation(len(keys))[:n_hold]}
+    train = {k: v for k, v in ratings.items() if k not in held}
+    users = sorted({k[0] for k in ratings}); items = sorted({k[1] for k in ratings})
+    mu = float(np.mean(list(train.values())))
+    n_factors = previous["qi"].shape[1] if previous is not None else args.factors
+    factors = rec.new_factors(users, items, n_factors, SCALE, mu, previous, args.seed)
+    epochs = args.warm_epochs if previous is not None else args.epochs
+    rec.fit_als(factors, *to_arrays(factors, train), epochs, args.reg)
+    stats = {"holdout": split_accuracy(factors, {k: ratings[k] for k in held}), "epochs": epochs,
+             "warm_start": previous is not None}
+    if held:
+        factors["mu"] = float(np.mean(list(ratings.values())))
+        rec.fit_als(factors, *to_arrays(factors, ratings), 2, args.reg)
+    return factors, stats
+
+def train_incremental(conn, delta, previous):
+    # Chỉ SV có điểm mới được giải lại (với nhân tố môn cố định); môn mới ghép vào bằng điểm của chính các SV đó.
+    # Chi phí tỉ lệ với số SV/môn bị ảnh hưởng, không phải với kích thước cả bảng grades.
+    stats = {"prequential": split_accuracy(previous, delta)} # Bản cũ dự đoán điểm mới trước khi được học
+    users = {k[0] for k in delta}
+    new_items = sorted({k[1] for k in delta} - set(previous["items"]))
+    history = load_user_ratings(conn, users)
+    factors = rec.extend_factors(previous, sorted(users), new_items, args.seed)
+    u, i, r = to_arrays(factors, history)
+    rec.fit_als(factors, u, i, r, 1, args.reg, update_items=False)
+    if new_items:
+        fresh = np.isin(i, [factors["items"][c] for c in new_items])
+        rec.als_step(i[fresh], u[fresh], r[fresh] - factors["mu"] - factors["bu"][u[fresh]], factors["pu"], args.reg,
+                     factors["qi"], factors["bi"])
+        rec.fit_als(factors, u, i, r, 1, args.reg, update_items=False)
+    stats.update({"affected_users": len(users), "new_users": len(users - set(previous["users"])),
+                  "new_items": len(new_items), "history_ratings": len(history),
+                  "after": split_accuracy(factors, delta)})
+    return factors, stats
+
+def write_artifact(factors):
+    # Ghi file tạm rồi đổi tên (nguyên tử) -> registry không bao giờ nạp phải file ghi dở
+    path = reserve_version_path(os.path.join(args.model_dir, NAME))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(factors, tmp)
+    os.replace(tmp, path)
+    return path
+
+if __name__ == "__main__":
+    print("Bắt đầu huấn luyện mô hình gợi ý...")
+    start = time.perf_counter()
+    source, previous = latest_artifact()
+    watermark = (previous or {}).get("meta", {}).get("watermark")
+    incremental = not args.full and watermark is not None
+
+    engine = create_engine(args.database_url)
+    with engine.connect() as conn:
+        try: ratings, new_watermark, rows = stream_grades(conn, watermark if incremental else 0)
+        except Exception as e:
+            print(f"⚠️ Không đọc được bảng grades: {e}")
+            ratings, new_watermark, rows = {}, 0, 0
+        read_seconds = time.perf_counter() - start
+
+        if incremental and not ratings:
+            raise SystemExit(f"✅ Không có điểm mới sau id {watermark} -> giữ nguyên {source}")
+        if not incremental and not ratings:
+            # DB chưa có điểm -> dùng file CSV mẫu
+            import pandas as pd
+            df = pd.read_csv("ratings.csv").groupby(["student_id", "subject_id"])["grade"].max()
+            ratings, new_watermark, rows = {k: float(v) for k, v in df.items()}, 0, len(df)
+        print(f"Số dòng điểm đọc được: {rows} ({len(ratings)} cặp SV-môn)")
+
+        train_start = time.perf_counter()
+        if incremental: factors, stats = train_incremental(conn, ratings, previous)
+        else: factors, stats = train_full(ratings, previous)
+        train_seconds = time.perf_counter() - train_start
+
+    stats.update({
+        "mode": "incremental" if incremental else "full", "base": source,
+        "rows_read": rows, "pairs": len(ratings), "watermark": new_watermark,
+        "n_users": len(factors["users"]), "n_items": len(factors["items"]), "n_factors": int(factors["qi"].shape[1]),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    factors["meta"] = {"watermark": new_watermark, "mode": stats["mode"], "base": source}
+    stats["timing"] = {"read_seconds": round(read_seconds, 3), "train_seconds": round(train_seconds, 3)}
+    write_start = time.perf_counter()
+    path = write_artifact(factors)
+    stats["timing"]["write_seconds"] = round(time.perf_counter() - write_start, 3)
+    stats["timing"]["total_seconds"] = round(time.perf_counter() - start, 3)
+    with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False, indent=2)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    print(f"Đã huấn luyện và lưu mô hình thành công: {path}")
@@ -1,19 +1,28 @@
+import json
+import os
+import time
+
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier # Chọn mô hình "Rừng Ngẫu nhiên"
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import cross_val_score
 import joblib
 
+from model_registry import reserve_version_path
+
 print("Bắt đầu huấn luyện mô hình dự báo rủi ro...")
 
-# 1. Đọc dữ liệu
+# 1. Đọc dữ liệu. Vẫn lấy từ risk_data.csv: bảng risk_features trong DB chỉ có đặc trưng đầu vào,
+#    chưa có cột nhãn (will_fail) -> chưa huấn luyện từ DB được
 df = pd.read_csv('risk_data.csv')
 
 # 2. Tách dữ liệu: X là "đặc trưng", y là "kết quả"
 X = df.drop('will_fail', axis=1) # Lấy 4 cột đầu
 y = df['will_fail']             # Lấy cột cuối (mục tiêu)
 
-# 3. (Optional) Chia train/test để xem độ chính xác
-# X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+# 3. Đo độ chính xác bằng kiểm định chéo (số fold không vượt quá số mẫu của lớp ít nhất)
+start = time.perf_counter()
+folds = min(5, int(y.value_counts().min()))
+cv_scores = cross_val_score(RandomForestClassifier(n_estimators=100, random_state=42), X, y, cv=folds) if folds >= 2 else []
 
 # 4. Chọn mô hình
 # RandomForest là mô hình rất tốt cho dữ liệu bảng
@@ -22,7 +31,19 @@ model = RandomForestClassifier(n_estimators=100, random_state=42)
 # 5. Dạy (train) mô hình với TOÀN BỘ dữ liệu (vì data ít)
 model.fit(X, y)
 
-# 6. Lưu mô hình (bộ não dự báo) ra file
-joblib.dump(model, 'risk_predictor.pkl')
-
-print("Đã huấn luyện và lưu mô hình DỰ BÁO RỦI RO thành công!")
\ No newline at end of file
+# 6. Lưu mô hình ra models/risk_predictor/<phiên bản>.pkl (ghi tạm rồi đổi tên) kèm file .json thống kê;
+#    server (ModelRegistry) ưu tiên bản mới nhất trong thư mục này hơn file risk_predictor.pkl gốc
+path = reserve_version_path(os.path.join(os.getenv("MODEL_DIR", "models"), "risk_predictor"))
+tmp = f"{path}.{os.getpid()}.tmp"
+joblib.dump(model, tmp)
+os.replace(tmp, path)
+stats = {
+    "rows": len(df), "features": list(X.columns), "cv_folds": folds,
+    "cv_accuracy": round(float(cv_scores.mean()), 4) if len(cv_scores) else None,
+    "train_accuracy": round(float(model.score(X, y)), 4),
+    "train_seconds": round(time.perf_counter() - start, 3), "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+}
+with open(os.path.splitext(path)[0] + ".json", "w", encoding="utf-8") as f: json.dump(stats, f, indent=2)
+print(stats)
+
+print(f"Đã huấn luyện và lưu mô hình DỰ BÁO RỦI RO thành công: {path}")
\ No newline at end of file